@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量运行提示词（无界面，与App共用grok_client.stream_chat，可用来回归测试新的API地址/代理）
+优化点：1. 从JSONL边读边跑（每行一个对象，兼容requests.jsonl的request_id/title/body），内存只与并发数有关
+        2. 并发数可配置；令牌桶按每分钟请求数、token数限流，遇到429全体暂停到Retry-After之后再重试
+        3. 结果逐条追加到输出JSONL并立即刷盘，输出文件即检查点：中断后重跑同一命令，已成功的提示词自动跳过
+        4. 结束时报告吞吐（请求/秒、token/秒）以及总延迟、首token耗时的p50/p90/p95/p99
+
+用法：python batch_runner.py prompts.jsonl results.jsonl --api-key xai-... --concurrency 4 --rpm 60 --tpm 40000
+      python batch_runner.py requests.jsonl results.jsonl --api-url http://127.0.0.1:8765/v1/chat/completions
+      （API密钥/地址也可用环境变量GROK_API_KEY、GROK_API_URL指定）
+"""
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+from context_window import estimate_tokens
+from session_store import DEFAULT_SYSTEM_PROMPT
+from grok_client import (ChatClient, TokenBucket, DEFAULT_MODEL, DEFAULT_API_URL, REQUEST_TIMEOUT, stream_chat,
+                         classify_error, retry_delay)
+
+DEFAULT_CONCURRENCY = 4
+MAX_RETRIES = 5  # 可重试错误（429、超时、5xx等）的最大重试次数
+TOKEN_BURST_SECONDS = 10  # token桶容量：允许一次性用掉多少秒的配额
+PROGRESS_INTERVAL = 0.5  # 进度输出的最小间隔（秒）
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class BatchError(Exception):
+    pass
+
+
+# 一行输入 -> {"id", "messages", "model"}；messages优先，其次prompt，再次title + body
+def parse_prompt(record, line_no, system_prompt, model):
+    if not isinstance(record, dict):
+        raise BatchError(f"第{line_no}行不是JSON对象")
+    prompt_id = str(record.get("id") or record.get("request_id") or f"line-{line_no}")
+    messages = record.get("messages")
+    if messages is None:
+        text = record.get("prompt")
+        if text is None and record.get("body"):
+            text = f"{record['title']}\n\n{record['body']}" if record.get("title") else record["body"]
+        if not text:
+            raise BatchError(f"第{line_no}行没有messages/prompt/body字段")
+        messages = [{"role": "user", "content": text}]
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+    return {"id": prompt_id, "messages": messages, "model": record.get("model", model)}
+
+
+def read_prompts(path, system_prompt, model):
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise BatchError(f"第{line_no}行不是合法的JSON")
+                yield parse_prompt(record, line_no, system_prompt, model)
+
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+# ========== 检查点：输出文件中已成功的ID；上次中断留下的半行先截掉，保证之后追加的每行都完整 ==========
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                f.truncate(offset)
+                break
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+# 最近秩法；values须已排序
+def percentile(values, ratio):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(ratio * len(values)) - 1))]
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {f"p{round(ratio * 100)}": percentile(values, ratio) for ratio in PERCENTILES}
+
+
+class BatchRunner:
+    def __init__(self, api_url, api_key, concurrency=DEFAULT_CONCURRENCY, rpm=None, tpm=None, burst=None,
+                 max_retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT, client=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # 连接池与并发数一致，每个worker都能拿到一条复用的连接
+        self.client = client or ChatClient(pool_limit=concurrency, limit_per_host=concurrency)
+        self.requests = TokenBucket(rpm / 60 if rpm else None, burst or concurrency)
+        self.tokens = TokenBucket(tpm / 60 if tpm else None, tpm * TOKEN_BURST_SECONDS / 60 if tpm else None)
+        self.stats = {"ok": 0, "failed": 0, "skipped": 0, "rate_limited": 0, "retries": 0, "events": 0,
+                      "reply_tokens": 0}
+        self.latencies = []
+        self.ttfts = []
+
+    # 单条提示词：限流 -> 请求 -> 失败按错误分类决定是否重试；返回写入输出文件的记录
+    async def run_one(self, prompt):
+        estimate = sum(estimate_tokens(message["content"]) for message in prompt["messages"])
+        started = time.perf_counter()
+        attempts = 0
+        while True:
+            await self.requests.acquire()
+            await self.tokens.acquire(estimate)
+            attempts += 1
+            request_started = time.perf_counter()
+            try:
+                result = await stream_chat(self.client, self.api_url, self.api_key, prompt["messages"],
+                                           model=prompt["model"], timeout=self.timeout)
+            except Exception as e:
+                error = classify_error(e)
+                if error.status == 429:
+                    # 配额已用完，所有worker一起等；重试在acquire里等到暂停结束
+                    self.stats["rate_limited"] += 1
+                    delay = retry_delay(attempts, error.retry_after)
+                    self.requests.pause(delay)
+                    self.tokens.pause(delay)
+                if error.retryable and attempts <= self.max_retries:
+                    self.stats["retries"] += 1
+                    if error.status != 429:
+                        await asyncio.sleep(retry_delay(attempts, error.retry_after))
+                    continue
+                self.stats["failed"] += 1
+                return {"id": prompt["id"], "status": "error", "error": error.message, "http_status": error.status,
+                        "attempts": attempts, "total_ms": (time.perf_counter() - started) * 1000}
+            latency_ms = (time.perf_counter() - request_started) * 1000
+            reply_tokens = estimate_tokens(result["reply"])
+            self.tokens.charge(reply_tokens)
+            self.stats["ok"] += 1
+            self.stats["events"] += result["tokens"]
+            self.stats["reply_tokens"] += reply_tokens
+            self.latencies.append(latency_ms)
+            if result["ttft_ms"] is not None:
+                self.ttfts.append(result["ttft_ms"])
+            return {"id": prompt["id"], "status": "ok", "reply": result["reply"], "attempts": attempts,
+                    "latency_ms": latency_ms, "ttft_ms": result["ttft_ms"],
+                    "total_ms": (time.perf_counter() - started) * 1000, "tokens": result["tokens"],
+                    "sse_errors": result["sse_errors"]}
+
+    async def worker(self, queue, out, progress):
+        while True:
+            prompt = await queue.get()
+            if prompt is None:
+                return
+            record = await self.run_one(prompt)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            progress()
+
+    # 输入按需读取，队列长度与并发数相同，不会把整个文件读进内存
+    async def run(self, input_path, output_path, system_prompt=DEFAULT_SYSTEM_PROMPT, model=DEFAULT_MODEL,
+                  progress=None):
+        done = load_checkpoint(output_path)
+        total = count_lines(input_path)
+        started = time.perf_counter()
+        queue = asyncio.Queue(self.concurrency)
+
+        def report():
+            if progress is not None:
+                progress(self, total, time.perf_counter() - started)
+        try:
+            with open(output_path, "a", encoding="utf-8") as out:
+                workers = [asyncio.create_task(self.worker(queue, out, report)) for _ in range(self.concurrency)]
+                try:
+                    seen = set()
+                    for prompt in read_prompts(input_path, system_prompt, model):
+                        if prompt["id"] in done or prompt["id"] in seen:
+                            self.stats["skipped"] += 1
+                            continue
+                        seen.add(prompt["id"])
+                        await queue.put(prompt)
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
+                finally:
+                    for task in workers:
+                        task.cancel()
+        finally:
+            await self.client.close()
+        return self.summary(time.perf_counter() - started, total)
+
+    def summary(self, elapsed, total):
+        finished = self.stats["ok"] + self.stats["failed"]
+        return dict(self.stats, total=total, elapsed_s=elapsed,
+                    requests_per_sec=finished / elapsed if elapsed else None,
+                    tokens_per_sec=self.stats["reply_tokens"] / elapsed if elapsed else None,
+                    latency_ms=percentiles(self.latencies), ttft_ms=percentiles(self.ttfts))
+
+
+class ProgressPrinter:
+    def __init__(self):
+        self.last = 0.0
+
+    def __call__(self, runner, total, elapsed):
+        now = time.monotonic()
+        if now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        stats = runner.stats
+        finished = stats["ok"] + stats["failed"] + stats["skipped"]
+        sys.stderr.write(f"\r完成 {finished}/{total}  失败 {stats['failed']}  限流 {stats['rate_limited']}"
+                         f"  {(stats['ok'] + stats['failed']) / elapsed if elapsed else 0:.1f}请求/秒")
+        sys.stderr.flush()
+
+
+def format_ms(values):
+    return " / ".join("-" if value is None else f"{value:.0f}" for value in values.values())
+
+
+def format_report(summary):
+    return "\n".join([
+        f"成功 {summary['ok']}，失败 {summary['failed']}，跳过（已完成/重复）{summary['skipped']}，"
+        f"共 {summary['total']}条；重试 {summary['retries']}次，其中429 {summary['rate_limited']}次",
+        f"用时 {summary['elapsed_s']:.1f}秒，吞吐 {summary['requests_per_sec'] or 0:.2f}请求/秒，"
+        f"{summary['tokens_per_sec'] or 0:.0f} token/秒",
+        f"延迟 p50/p90/p95/p99：{format_ms(summary['latency_ms'])} ms",
+        f"首token p50/p90/p95/p99：{format_ms(summary['ttft_ms'])} ms",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GrokChat批量运行提示词")
+    parser.add_argument("input", help="提示词JSONL：每行含messages，或prompt，或title/body；id或request_id作为检查点键")
+    parser.add_argument("output", help="结果JSONL（追加写入，同时作为检查点）")
+    parser.add_argument("--api-url", default=os.environ.get("GROK_API_URL", DEFAULT_API_URL))
+    parser.add_argument("--api-key", default=os.environ.get("GROK_API_KEY", ""))
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--system", default=DEFAULT_SYSTEM_PROMPT, help="系统提示（空字符串表示不加）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时进行的请求数")
+    parser.add_argument("--rpm", type=float, help="每分钟请求数上限（按服务商的限额设置）")
+    parser.add_argument("--tpm", type=float, help="每分钟token数上限（提问按估算预扣，回复按实际补扣）")
+    parser.add_argument("--burst", type=int, help="请求数令牌桶容量（默认等于并发数）")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="单次请求超时（秒）")
+    parser.add_argument("--summary", help="把统计结果另存为JSON")
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error("缺少API密钥（--api-key或环境变量GROK_API_KEY）")
+
+    runner = BatchRunner(args.api_url, args.api_key, max(1, args.concurrency), args.rpm, args.tpm, args.burst,
+                         args.max_retries, args.timeout)
+    try:
+        summary = asyncio.run(runner.run(args.input, args.output, args.system, args.model, ProgressPrinter()))
+    except BatchError as e:
+        sys.stderr.write(f"\n{e}\n")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.stderr.write(f"\n已中断（已完成 {runner.stats['ok']}条），重新运行同一命令即可从断点继续\n")
+        sys.exit(130)
+    sys.stderr.write("\n")
+    print(format_report(summary))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
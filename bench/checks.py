@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+正确性检查（assert，无界面、无需外网）：基准只计时，解析器的边界情况在这里核对
+覆盖：1. SSE解码（跨块的CR/CRLF、流末尾单独的CR、多行data、心跳事件） 2. Markdown增量切块与整条切块一致
+        3. 中日韩/拉丁混排的搜索词 4. 按预算组装上下文时不以孤立的回复开头
+
+用法：python bench/checks.py（run_bench默认也会先运行）
+"""
+import os
+import sys
+import json
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sse_decoder import ChatStreamParser
+from markdown_markup import MarkdownStream, split_blocks
+from search_index import build_fts_query, make_snippet
+from session_store import SessionStore
+from context_window import assemble_context, estimate_tokens
+
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+# 逐个运行，第一个失败的检查抛出AssertionError；返回通过的检查名
+def run_checks():
+    passed = []
+    for fn in CHECKS:
+        fn()
+        passed.append(fn.__name__)
+    return passed
+
+
+# ========== SSE解码 ==========
+def sse_chunk(content, newline=b"\n"):
+    data = json.dumps({"choices": [{"delta": {"content": content}}]}, ensure_ascii=False).encode("utf-8")
+    return b"data: " + data + newline + newline
+
+
+def sse_parse(chunks):
+    parser = ChatStreamParser()
+    contents = []
+    for chunk in chunks:
+        contents.extend(parser.feed(chunk))
+    contents.extend(parser.close())
+    return contents, parser
+
+
+@check
+def sse_split_anywhere():
+    # 同一段流按任意位置切块，结果与整块解析相同
+    body = sse_chunk("a") + sse_chunk("b", b"\r\n") + sse_chunk("c", b"\r") + b"data: [DONE]\n\n"
+    expected = ["a", "b", "c"]
+    assert sse_parse([body])[0] == expected
+    for size in range(1, 8):
+        assert sse_parse([body[i:i + size] for i in range(0, len(body), size)])[0] == expected, size
+
+
+@check
+def sse_crlf_split_across_chunks():
+    # \r\n被切在两块之间不能算成两个换行（那样会提前结束事件）
+    first = sse_chunk("x", b"\r\n")
+    cut = first.index(b"\r\n") + 1
+    contents, parser = sse_parse([first[:cut], first[cut:], sse_chunk("y")])
+    assert contents == ["x", "y"] and parser.errors == 0, (contents, parser.last_error)
+
+
+@check
+def sse_trailing_bare_cr():
+    # 最后一个事件以单独的\r结束：流结束时才能确定它不是\r\n的前半
+    contents, parser = sse_parse([sse_chunk("last", b"\r")])
+    assert contents == ["last"] and parser.errors == 0, (contents, parser.last_error)
+
+
+@check
+def sse_multiline_data():
+    body = b'data: {"choices":\ndata: [{"delta": {"content": "m"}}]}\n\n'
+    assert sse_parse([body])[0] == ["m"]
+    assert sse_parse([body[:20], body[20:]])[0] == ["m"]
+
+
+@check
+def sse_ping_event():
+    # 心跳等具名事件不是回复片段，也不算格式错误；event字段单独在上一块时同样生效
+    contents, parser = sse_parse([b"event: ping\ndata: {}\n\n", sse_chunk("a"), b"event: ping\n", b"data: {}\n\n",
+                                  b": comment\n\n", sse_chunk("b")])
+    assert contents == ["a", "b"], contents
+    assert parser.errors == 0 and parser.ignored == 2, (parser.errors, parser.ignored, parser.last_error)
+
+
+@check
+def sse_malformed_and_done():
+    contents, parser = sse_parse([b"data: {oops\n\n", sse_chunk("a"), b"data: [DONE]\n\n", sse_chunk("after")])
+    assert contents == ["a"] and parser.errors == 1 and parser.done
+
+
+# ========== Markdown增量切块 ==========
+MARKDOWN_SAMPLES = [
+    "## 示例\n下面是 **代码**：\n\n```python\ndef f(a):\n\n    return a[0]\n```\n\n- 列表\n- 第二项\n\n",
+    "段落后面紧跟代码块\n```\ncode\n```\n结尾段落",
+    "~~~\n波浪线围栏\n~~~\n\n\n\n多个空行之后\n   \n空白行也结束块",
+    "```js\n没有闭合的代码块\n\n仍在代码块中",
+    "\n\n开头的空行\n> 引用\n\n---\n\n1. 有序\n2. 列表",
+]
+
+
+@check
+def markdown_stream_matches_split_blocks():
+    # 无论按什么粒度推入，已完成的块 + 最后的尾部 必须与整条切块相同
+    for text in MARKDOWN_SAMPLES:
+        expected = split_blocks(text)
+        for size in (1, 2, 3, 5, 8, len(text)):
+            stream = MarkdownStream()
+            blocks = []
+            for start in range(0, len(text), size):
+                blocks.extend(stream.feed(text[start:start + size]))
+            if stream.tail.strip():
+                blocks.append(stream.tail)
+            assert blocks == expected, (text, size, blocks, expected)
+
+
+# ========== 全文搜索 ==========
+@check
+def search_mixed_cjk_latin():
+    # “用Python写”要切成 用 / Python / 写，与索引中的切分一致
+    assert build_fts_query("用Python写") == '"用"* "Python" "写"*'
+    assert build_fts_query("会话列表 SQLite") == '"会话 话列 列表" "SQLite"'
+    assert build_fts_query("   ") is None
+    assert "Python" in make_snippet("前面很长的一段说明文字，然后我用Python写了一个脚本", "用Python写")
+    with tempfile.TemporaryDirectory() as workdir:
+        store = SessionStore(os.path.join(workdir, "check.db"))
+        try:
+            with store.lock, store.conn:
+                store.insert_message("default", "user", "我想用Python写一个爬虫", "09:00")
+                store.insert_message("default", "grok", "可以用requests库", "09:01")
+            for query in ("用Python写", "python", "爬虫", "爬", "REQUESTS"):
+                assert [r["role"] for r in store.search(query)] == (["grok"] if query == "REQUESTS" else ["user"]), query
+            assert store.search("Java写") == []
+        finally:
+            store.close()
+
+
+# ========== 上下文组装 ==========
+@check
+def context_drops_orphaned_reply():
+    # history从新到旧；预算在一轮中间用完时，放进来的最早一条是回复，要丢掉
+    turns = [("grok", "A2"), ("user", "Q2"), ("grok", "A1"), ("user", "Q1")]
+    history = [(role, content, estimate_tokens(content)) for role, content in turns]
+    per_message = history[0][2]
+    base = estimate_tokens("system") + estimate_tokens("Q3")
+
+    def roles(budget):
+        messages = assemble_context("system", iter(history), "Q3", budget)
+        return [m["role"] for m in messages]
+    assert roles(base + per_message * 4) == ["system", "user", "assistant", "user", "assistant", "user"]
+    # 只够三条：A2 Q2 A1，A1的提问没放进来
+    assert roles(base + per_message * 3) == ["system", "user", "assistant", "user"]
+    assert roles(base + per_message) == ["system", "user"]
+    assert roles(0) == ["system", "user"]
+    assert [m["role"] for m in assemble_context(None, iter(history), "Q3", 10 ** 6)] == \
+        ["user", "assistant", "user", "assistant", "user"]
+
+
+if __name__ == "__main__":
+    for name in run_checks():
+        print(f"通过 {name}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成旧版sessions.json格式的合成会话档案（10 ~ 10000个会话），供基准测试使用
+优化点：1. 固定随机种子，不同提交之间生成完全相同的数据 2. 中英文混合、长短不一的消息，接近真实分布
+
+用法：python bench/gen_archive.py sessions.json --sessions 1000 --messages 40
+"""
+import json
+import random
+import argparse
+import datetime
+
+SYSTEM_PROMPT = "You are a helpful assistant. Answer questions clearly and concisely."
+CJK_WORDS = ["会话", "列表", "缓存", "网络", "请求", "模型", "回复", "消息", "搜索", "索引", "性能", "界面"]
+LATIN_WORDS = ["cache", "stream", "token", "python", "kivy", "sqlite", "latency", "model", "query", "layout"]
+
+
+def make_text(rng, words):
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(CJK_WORDS) if rng.random() < 0.6 else " " + rng.choice(LATIN_WORDS) + " ")
+    # 较长的回复分成几段
+    if words > 60:
+        for _ in range(words // 60):
+            parts.insert(rng.randrange(len(parts)), "\n\n")
+    return "".join(parts).strip()
+
+
+def make_session(rng, index, messages, started):
+    moment = started + datetime.timedelta(minutes=index * 7)
+    history = []
+    for turn in range(messages // 2):
+        time = (moment + datetime.timedelta(seconds=turn * 30)).strftime("%H:%M")
+        history.append({"role": "user", "content": make_text(rng, rng.randint(3, 30)), "time": time})
+        history.append({"role": "grok", "content": make_text(rng, rng.randint(20, 300)), "time": time})
+    session_id = "default" if index == 0 else f"session_{moment.strftime('%Y%m%d%H%M%S')}_{index}"
+    return {
+        "id": session_id,
+        "name": "默认会话" if index == 0 else (history[0]["content"][:20] if history else "新会话"),
+        "last_msg": history[-2]["content"][:30] if history else "",
+        "timestamp": moment.strftime("%Y-%m-%d %H:%M:%S"),
+        "messages": history,
+        # 旧版固定保留最近20条作为上下文
+        "context": [{"role": "system", "content": SYSTEM_PROMPT}] + [
+            {"role": "assistant" if m["role"] == "grok" else m["role"], "content": m["content"]}
+            for m in history[-20:]]
+    }
+
+
+def build_archive(sessions, messages=20, seed=0):
+    rng = random.Random(seed)
+    started = datetime.datetime(2024, 1, 1, 9, 0, 0)
+    return {
+        "current_session": "default",
+        "sessions": [make_session(rng, index, messages, started) for index in range(sessions)]
+    }
+
+
+def write_archive(path, sessions, messages=20, seed=0):
+    archive = build_archive(sessions, messages, seed)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(archive, f, ensure_ascii=False)
+    return archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成会话档案")
+    parser.add_argument("path")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20, help="每个会话的消息条数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    archive = write_archive(args.path, args.sessions, args.messages, args.seed)
+    total = sum(len(s["messages"]) for s in archive["sessions"])
+    print(f"已生成 {args.path}：{args.sessions}个会话，{total}条消息")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的chat/completions接口（aiohttp），供基准测试离线使用
+优化点：1. 按OpenAI格式流式返回SSE，可配置token数、速率、每个事件的token数、每次写出的字节数 2. 可模拟401/403/429/500等错误
+        3. 每次请求可用查询参数覆盖默认配置，同一个服务跑多种场景 4. 可模拟服务商的每秒请求数限额，超出返回429
+
+用法：python bench/mock_server.py --port 8765 --tokens 500 --rate 50
+      请求地址 http://127.0.0.1:8765/v1/chat/completions?tokens=200&chunk=4&status=429
+"""
+import json
+import time
+import asyncio
+import argparse
+from aiohttp import web
+
+CHAT_PATH = "/v1/chat/completions"
+DEFAULT_CONFIG = {
+    "tokens": 200,  # 回复token数
+    "rate": 0.0,  # 每秒token数，0表示不限速
+    "chunk": 1,  # 每个SSE事件包含的token数
+    "write_size": 0,  # 每次写出的字节数（可把事件切断在任意位置），0表示按事件写出
+    "status": 200,  # 非200时直接返回错误
+    "retry_after": 1,  # 429时的Retry-After（秒）
+    "limit_rps": 0,  # 每秒请求数限额（按整秒计数），超出返回429，0表示不限
+    "token": "测试",  # 单个token的文本，每20个token插入一次段落分隔
+}
+ERROR_BODIES = {
+    401: "invalid api key",
+    403: "region not supported",
+    429: "rate limited",
+    500: "internal error",
+}
+
+
+def request_config(defaults, query):
+    config = dict(defaults)
+    for key, value in query.items():
+        if key not in config:
+            continue
+        config[key] = value if isinstance(config[key], str) else type(config[key])(value)
+    return config
+
+
+def sse_event(content):
+    data = json.dumps({"choices": [{"delta": {"content": content}}]}, ensure_ascii=False)
+    return f"data: {data}\n\n".encode("utf-8")
+
+
+def make_tokens(config):
+    tokens = []
+    for index in range(config["tokens"]):
+        tokens.append("\n\n" if index % 20 == 19 else config["token"])
+    return tokens
+
+
+def make_app(**overrides):
+    defaults = dict(DEFAULT_CONFIG, **overrides)
+    app = web.Application()
+    app["requests"] = 0
+    app["window"] = [0, 0]  # [当前整秒, 本秒内的请求数]
+
+    async def chat(request):
+        app["requests"] += 1
+        config = request_config(defaults, request.query)
+        status = config["status"]
+        if config["limit_rps"] > 0:
+            second = int(time.monotonic())
+            if app["window"][0] != second:
+                app["window"] = [second, 0]
+            app["window"][1] += 1
+            if app["window"][1] > config["limit_rps"]:
+                status = 429
+        if status != 200:
+            headers = {"Retry-After": str(config["retry_after"])} if status == 429 else None
+            return web.json_response({"error": ERROR_BODIES.get(status, "error")}, status=status, headers=headers)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        tokens = make_tokens(config)
+        chunk = max(1, config["chunk"])
+        delay = chunk / config["rate"] if config["rate"] > 0 else 0
+        write_size = config["write_size"]
+        buffer = b""
+        for start in range(0, len(tokens), chunk):
+            buffer += sse_event("".join(tokens[start:start + chunk]))
+            while len(buffer) >= max(1, write_size):
+                cut = write_size or len(buffer)
+                await response.write(buffer[:cut])
+                buffer = buffer[cut:]
+            if delay:
+                await asyncio.sleep(delay)
+        await response.write(buffer + b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # 连接预热用HEAD请求
+    async def head(request):
+        return web.Response()
+
+    app.router.add_post(CHAT_PATH, chat)
+    app.router.add_route("HEAD", CHAT_PATH, head)
+    return app
+
+
+# 在当前事件循环中启动，返回 (runner, 接口地址)；port为0时自动分配
+async def start_server(host="127.0.0.1", port=0, **overrides):
+    runner = web.AppRunner(make_app(**overrides))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}{CHAT_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟Grok流式接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tokens", type=int, default=DEFAULT_CONFIG["tokens"])
+    parser.add_argument("--rate", type=float, default=DEFAULT_CONFIG["rate"])
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CONFIG["chunk"])
+    parser.add_argument("--write-size", type=int, default=DEFAULT_CONFIG["write_size"])
+    parser.add_argument("--status", type=int, default=DEFAULT_CONFIG["status"])
+    parser.add_argument("--limit-rps", type=int, default=DEFAULT_CONFIG["limit_rps"])
+    args = parser.parse_args()
+    app = make_app(tokens=args.tokens, rate=args.rate, chunk=args.chunk,
+                   write_size=args.write_size, status=args.status, limit_rps=args.limit_rps)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+无界面基准测试（Linux、无需外网）
+优化点：1. SessionManager 迁移/加载/打开会话/发送消息（outbox入队、回复写回）/组装上下文/冷会话归档与恢复/导出导入，档案规模10 ~ 10000个会话
+        2. get_grok_response 流式解析（对接本地模拟接口，含401/403/429/500、开启性能埋点时的开销、多会话并发）；
+           批量运行在服务端限额下不限流与令牌桶限流的对比 3. StreamRenderer刷新与load_chat_messages建行
+        4. SSE解码（逐行解析旧实现 vs sse_decoder，json/orjson，不同网络块大小） 5. 冷启动导入main.py的耗时
+        6. 结果输出为JSON，可在两次提交之间对比 7. 计时前先运行checks.py中的正确性检查，失败时退出码为1
+
+用法：python bench/run_bench.py --output head.json
+      python bench/run_bench.py --compare base.json head.json --threshold 10
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import traceback
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gen_archive import write_archive
+from mock_server import start_server
+from session_store import SessionManager, SessionStore, cold_cutoff
+from session_transfer import export_archive, import_archive
+from grok_client import ChatClient, ChatRequestError
+from perf_metrics import PerfRecorder, NULL_TRACE
+from sse_decoder import ChatStreamParser, json_loads, orjson
+from reply_manager import MAX_ACTIVE_REPLIES
+from batch_runner import BatchRunner
+from mock_server import sse_event
+from checks import run_checks
+
+DEFAULT_SIZES = "10,100,1000,10000"
+STREAM_TOKENS = 2000
+CONCURRENT_TOKENS = 200  # 并发场景每条回复的token数，按CONCURRENT_RATE限速
+CONCURRENT_RATE = 1000
+# Markdown流式渲染基准的回复片段（按token切好），循环拼接到STREAM_TOKENS个
+MARKDOWN_SAMPLE = ["## ", "示例", "\n", "下面", "是", " **", "代码", "**", "：", "\n\n", "```", "python", "\n",
+                   "def ", "f", "(a", "):", "\n", "    ", "return", " a[0]", "\n", "```", "\n\n", "- ", "列表",
+                   " `x[1]`", "\n", "- ", "第二项", "\n\n"]
+# 气泡渲染基准的短回复token数；长回复为STREAM_TOKENS个token（气泡约1万像素高）。
+# 再长的回复整块Label的纹理会超过常见的最大纹理尺寸（16384），生成纹理的内存随之失控
+BUBBLE_SHORT_TOKENS = 250
+SSE_EVENTS = 20000  # SSE解码基准的事件数（模拟高token速率下的一整段回复）
+ERROR_STATUSES = (401, 403, 429, 500)
+# 批量运行：模拟接口每秒限额BATCH_LIMIT_RPS个请求，令牌桶按限额的90%放行
+BATCH_PROMPTS = 40
+BATCH_CONCURRENCY = 8
+BATCH_LIMIT_RPS = 10
+TRANSFER_IMPORT_MAX_SESSIONS = 1000  # 导入写全文索引较慢，更大的档案只测导出
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "max_ms": max(samples)
+    }
+
+
+# 界面相关的基准需要导入main.py（Kivy），导入失败时记录原因并跳过
+def load_main():
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+    os.environ.setdefault("KIVY_HOME", os.path.join(tempfile.gettempdir(), "grokchat-bench-kivy"))
+    try:
+        import main
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return main, None
+
+
+# ========== SessionManager ==========
+def bench_session_manager(workdir, sizes, messages, repeat):
+    results = {}
+    for size in sizes:
+        archive_path = os.path.join(workdir, f"archive_{size}.json")
+        write_archive(archive_path, size, messages)
+        db_path = os.path.join(workdir, f"sessions_{size}.db")
+        legacy_path = os.path.join(workdir, "sessions.json")
+
+        def migrate():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            shutil.copyfile(archive_path, legacy_path)
+            SessionManager(db_path, legacy_path).store.conn.close()
+
+        # 大档案迁移耗时较长，只跑一次
+        results[f"session_manager.migrate[{size}]"] = measure(migrate, 1 if size >= 1000 else repeat)
+        results[f"session_manager.load[{size}]"] = measure(lambda: SessionManager(db_path).store.conn.close(), repeat)
+
+        manager = SessionManager(db_path)
+        sample = [s["id"] for s in manager.sessions[:50]]
+
+        # 与App切换会话相同：切换当前会话指针并读取最新一页消息
+        current = manager.current_session_id
+        accessed = manager.store.conn.execute("SELECT accessed, id FROM sessions").fetchall()
+
+        def open_sessions():
+            for session_id in sample:
+                manager.set_current_session(session_id)
+                manager.get_message_page(session_id, limit=50)
+        results[f"session_manager.open_50[{size}]"] = measure(open_sessions, repeat)
+        # 打开会刷新访问时间、改变当前会话，恢复原状，否则抽样会话不再是冷会话，下面的归档/恢复基准测不到它们
+        with manager.store.lock, manager.store.conn:
+            manager.store.conn.executemany("UPDATE sessions SET accessed = ? WHERE id = ?",
+                                           [tuple(row) for row in accessed])
+        manager.set_current_session(current)
+
+        # 合成档案的时间早于归档阈值，除当前会话外全部会被归档；与App后台归档相同，用独立连接调用archive_cold
+        archived = []
+
+        def archive():
+            store = SessionStore(db_path)
+            try:
+                archived.extend(store.archive_cold(cold_cutoff(30), {manager.current_session_id}))
+            finally:
+                store.close()
+        results[f"session_store.archive_cold[{size}]"] = measure(archive, 1)
+        assert len(archived) == size - 1, f"只归档了{len(archived)}/{size - 1}个会话"
+        for session_id in archived:
+            manager.mark_archived(session_id)
+        report = manager.storage_report()
+        results[f"session_manager.storage[{size}]"] = {
+            "runs": 1,
+            "median_ms": 0.0,
+            "file_bytes": report["file_bytes"],
+            "archived_raw_bytes": report["archived_raw_bytes"],
+            "archived_bytes": report["archived_bytes"]
+        }
+        # 恢复抽样会话，后面的追加/组装上下文仍在普通会话上测量
+        results[f"session_manager.restore_50[{size}]"] = measure(
+            lambda: [manager.restore(session_id) for session_id in sample], 1)
+
+        # App发送消息的写入路径：提问写入outbox，投递开始时入库，回复生成后写回并出队
+        enqueue_samples, complete_samples = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            entries = [manager.enqueue_message(sample[index % len(sample)], "基准测试提问") for index in range(100)]
+            enqueue_samples.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            for entry in entries:
+                manager.start_outbox(entry)
+                manager.complete_outbox(entry, "基准测试回复" * 20)
+            complete_samples.append((time.perf_counter() - started) * 1000)
+        results[f"session_manager.enqueue_100[{size}]"] = summarize(enqueue_samples)
+        results[f"session_manager.complete_outbox_100[{size}]"] = summarize(complete_samples)
+
+        def context():
+            for session_id in sample:
+                manager.build_context(session_id, "继续", "grok-1")
+        results[f"session_manager.build_context_50[{size}]"] = measure(context, repeat)
+
+        # 导出两种格式（含已归档会话）；导入到空库，大档案只跑一次
+        for fmt, suffix in (("binary", "gcx"), ("jsonl", "jsonl")):
+            export_path = os.path.join(workdir, f"export_{size}.{suffix}")
+            result = measure(lambda: export_archive(manager.store, export_path, fmt), 1 if size >= 1000 else repeat)
+            result["file_bytes"] = os.path.getsize(export_path)
+            results[f"session_transfer.export_{fmt}[{size}]"] = result
+        if size <= TRANSFER_IMPORT_MAX_SESSIONS:
+            import_path = os.path.join(workdir, f"import_{size}.db")
+            store = SessionStore(import_path)
+            results[f"session_transfer.import_binary[{size}]"] = measure(
+                lambda: import_archive(store, os.path.join(workdir, f"export_{size}.gcx")), 1)
+            # 再次导入同一档案：全部按哈希去重
+            results[f"session_transfer.reimport_binary[{size}]"] = measure(
+                lambda: import_archive(store, os.path.join(workdir, f"export_{size}.gcx")), 1)
+            store.close()
+        manager.store.conn.close()
+    return results
+
+
+# ========== 流式解析：get_grok_response 对接本地模拟接口 ==========
+class TokenSink:
+    # 代替StreamRenderer，只收集token，单独测量解析开销
+    def __init__(self):
+        self.parts = []
+
+    def append(self, token):
+        self.parts.append(token)
+
+    def finish(self):
+        return "".join(self.parts)
+
+
+async def run_stream(main, url, workdir, repeat):
+    results = {}
+    client = ChatClient()
+    recorder = PerfRecorder(os.path.join(workdir, "perf_metrics.jsonl"), enabled=True)
+    app = types.SimpleNamespace(api_key="bench", chat_client=client, api_url=url)
+    messages = [{"role": "user", "content": "基准测试"}]
+    scenarios = [("chunk1", 1, 0, False), ("chunk8", 8, 0, False), ("chunk1_split7", 1, 7, False),
+                 ("chunk1_traced", 1, 0, True)]
+    for name, chunk, write_size, traced in scenarios:
+        app.api_url = f"{url}?tokens={STREAM_TOKENS}&chunk={chunk}&write_size={write_size}"
+        samples = []
+        for _ in range(repeat):
+            sink = TokenSink()
+            trace = recorder.trace("bench") if traced else NULL_TRACE
+            started = time.perf_counter()
+            reply = await main.GrokChatApp.get_grok_response(app, messages, sink, trace)
+            trace.end()
+            samples.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(samples)
+        results[f"stream.parse[{name}]"] = {
+            "runs": repeat,
+            "min_ms": min(samples),
+            "median_ms": median,
+            "max_ms": max(samples),
+            "events": len(sink.parts),
+            "reply_chars": len(reply),
+            "tokens_per_sec": STREAM_TOKENS / (median / 1000) if median else None,
+            "avg_ttft_ms": client.average_ttft_ms()
+        }
+
+    # 多会话并发：限速的模拟接口下，串行与同时生成MAX_ACTIVE_REPLIES条回复的总耗时
+    app.api_url = f"{url}?tokens={CONCURRENT_TOKENS}&rate={CONCURRENT_RATE}"
+    for name, width in (("serial", 1), ("concurrent", MAX_ACTIVE_REPLIES)):
+        started = time.perf_counter()
+        for _ in range(0, MAX_ACTIVE_REPLIES, width):
+            await asyncio.gather(*(main.GrokChatApp.get_grok_response(app, messages, TokenSink())
+                                   for _ in range(width)))
+        elapsed = (time.perf_counter() - started) * 1000
+        results[f"stream.replies[{name},{MAX_ACTIVE_REPLIES}]"] = {
+            "runs": 1,
+            "median_ms": elapsed,
+            "tokens_per_sec": CONCURRENT_TOKENS * MAX_ACTIVE_REPLIES / (elapsed / 1000)
+        }
+
+    for status in ERROR_STATUSES:
+        app.api_url = f"{url}?status={status}"
+        started = time.perf_counter()
+        try:
+            await main.GrokChatApp.get_grok_response(app, messages, TokenSink())
+            error = None
+        except ChatRequestError as e:
+            error = e
+        elapsed = (time.perf_counter() - started) * 1000
+        results[f"stream.error[{status}]"] = {
+            "runs": 1,
+            "median_ms": elapsed,
+            "raised": error is not None and error.status == status,
+            "retryable": error.retryable if error else None,
+            "retry_after": error.retry_after if error else None
+        }
+
+    prompts_path = os.path.join(workdir, "batch_prompts.jsonl")
+    with open(prompts_path, "w", encoding="utf-8") as f:
+        for index in range(BATCH_PROMPTS):
+            f.write(json.dumps({"id": f"bench-{index}", "prompt": "基准测试"}) + "\n")
+    batch_url = f"{url}?tokens={CONCURRENT_TOKENS}&rate={CONCURRENT_RATE}&limit_rps={BATCH_LIMIT_RPS}"
+    for name, rpm in (("unthrottled", None), ("token_bucket", BATCH_LIMIT_RPS * 60 * 0.9)):
+        runner = BatchRunner(batch_url, "bench", BATCH_CONCURRENCY, rpm=rpm, burst=1)
+        summary = await runner.run(prompts_path, os.path.join(workdir, f"batch_{name}.jsonl"))
+        results[f"batch.run[{name},{BATCH_PROMPTS}]"] = {
+            "runs": 1,
+            "median_ms": summary["elapsed_s"] * 1000,
+            "ok": summary["ok"],
+            "rate_limited": summary["rate_limited"],
+            "requests_per_sec": summary["requests_per_sec"],
+            "latency_p50_ms": summary["latency_ms"]["p50"],
+            "latency_p95_ms": summary["latency_ms"]["p95"]
+        }
+    await client.close()
+    recorder.close()
+    return results
+
+
+async def bench_stream(main, workdir, repeat):
+    runner, url = await start_server()
+    try:
+        return await run_stream(main, url, workdir, repeat)
+    finally:
+        await runner.cleanup()
+
+
+# ========== SSE解码：与原先逐行解码+json.loads的循环对比 ==========
+def legacy_parse(lines):
+    # 原get_grok_response中的解析循环（aiohttp已按行切好）
+    contents = []
+    for line in lines:
+        if line:
+            line_text = line.decode('utf-8').strip()
+            if line_text.startswith("data: "):
+                data = line_text[6:]
+                if data == "[DONE]":
+                    break
+                try:
+                    json_data = json.loads(data)
+                    delta = json_data["choices"][0]["delta"]
+                    if "content" in delta:
+                        contents.append(delta["content"])
+                except Exception as e:
+                    continue
+    return contents
+
+
+def decoder_parse(chunks, loads=None):
+    parser = ChatStreamParser(loads)
+    contents = []
+    for chunk in chunks:
+        contents.extend(parser.feed(chunk))
+        if parser.done:
+            break
+    contents.extend(parser.close())
+    return contents
+
+
+def bench_sse(repeat):
+    results = {}
+    body = b"".join(sse_event("测试" if index % 20 else "\n\n") for index in range(SSE_EVENTS)) + b"data: [DONE]\n\n"
+    lines = body.splitlines(keepends=True)
+    results[f"sse.legacy_lines[{SSE_EVENTS}]"] = measure(lambda: legacy_parse(lines), repeat)
+    decoders = [("json", json_loads)]
+    if orjson is not None:
+        decoders.append(("orjson", orjson.loads))
+    # 每个事件单独到达（实时流中iter_any的典型情况） / 典型TCP段 / 大块聚合
+    events = [event + b"\n\n" for event in body.split(b"\n\n") if event]
+    for chunk_name, size in (("per_event", None), ("1400b", 1400), ("64kb", 65536)):
+        chunks = events if size is None else [body[i:i + size] for i in range(0, len(body), size)]
+        for decoder_name, loads in decoders:
+            result = measure(lambda: decoder_parse(chunks, loads), repeat)
+            result["events_per_sec"] = SSE_EVENTS / (result["median_ms"] / 1000)
+            results[f"sse.decoder[{decoder_name},{chunk_name}]"] = result
+    return results
+
+
+# ========== 界面：StreamRenderer刷新、load_chat_messages建行 ==========
+def bench_transcript(main, workdir, messages, repeat):
+    results = {}
+    archive_path = os.path.join(workdir, "transcript.json")
+    write_archive(archive_path, 1, messages)
+    manager = SessionManager(os.path.join(workdir, "transcript.db"), archive_path)
+    view = types.SimpleNamespace(session_manager=manager, chat_scroll=main.ChatTranscript(),
+                                 attach_live_reply=lambda: None, attach_queued_messages=lambda: None)
+
+    def load_cold():
+        main.bubble_layout_cache.heights.clear()
+        main.bubble_layout_cache.markups.clear()
+        main.GrokChatApp.load_chat_messages(view)
+    results[f"transcript.load_chat_messages_cold[{main.MESSAGE_PAGE_SIZE}]"] = measure(load_cold, repeat)
+    results[f"transcript.load_chat_messages_warm[{main.MESSAGE_PAGE_SIZE}]"] = measure(
+        lambda: main.GrokChatApp.load_chat_messages(view), repeat)
+
+    def load_older():
+        main.GrokChatApp.load_chat_messages(view)
+        while main.GrokChatApp.load_older_messages(view):
+            pass
+    results[f"transcript.load_older_all[{messages}]"] = measure(load_older, 1)
+
+    # 模拟每帧刷新一次：每4个token刷新，段落随分隔符固定
+    def render():
+        view.chat_scroll.data = []
+        row = view.chat_scroll.append_row("", "grok", "09:00")
+        renderer = main.StreamRenderer(view.chat_scroll, row)
+        for index in range(STREAM_TOKENS):
+            renderer.append("\n\n" if index % 20 == 19 else "测试")
+            if index % 4 == 3:
+                renderer.flush()
+        renderer.finish()
+        renderer.flush()
+    results[f"transcript.stream_render[{STREAM_TOKENS}]"] = measure(render, repeat)
+
+    # Markdown回复：代码块、列表、行内格式混排，逐token推入（每4个token刷新一次）
+    markdown_tokens = (MARKDOWN_SAMPLE * (STREAM_TOKENS // len(MARKDOWN_SAMPLE) + 1))[:STREAM_TOKENS]
+
+    def render_markdown():
+        view.chat_scroll.data = []
+        row = view.chat_scroll.append_row("", "grok", "09:00")
+        renderer = main.StreamRenderer(view.chat_scroll, row)
+        for index, token in enumerate(markdown_tokens):
+            renderer.append(token)
+            if index % 4 == 3:
+                renderer.flush()
+        renderer.finish()
+        renderer.flush()
+    results[f"transcript.stream_render_markdown[{STREAM_TOKENS}]"] = measure(render_markdown, repeat)
+
+    # 实际渲染气泡：每次刷新后用行数据更新复用的MessageRow，文字有变化的Label重新生成纹理（与界面绘制一帧时相同），
+    # 长回复下应只有尾部Label随刷新重排
+    def render_bubble(tokens):
+        view.chat_scroll.data = []
+        row = view.chat_scroll.append_row("", "grok", "09:00")
+        renderer = main.StreamRenderer(view.chat_scroll, row)
+        widget = main.MessageRow()
+        labels = (widget.bubble.frozen_label, widget.bubble.text_label)
+
+        def draw():
+            widget.refresh_view_attrs(view.chat_scroll, 0, row)
+            for label in labels:
+                if label._trigger_texture.is_triggered:
+                    label._trigger_texture.cancel()
+                    label.texture_update()
+        for index, token in enumerate(tokens):
+            renderer.append(token)
+            if index % 4 == 3:
+                renderer.flush()
+                draw()
+        renderer.finish()
+        renderer.flush()
+        draw()
+    results[f"transcript.stream_render_bubble[{BUBBLE_SHORT_TOKENS}]"] = measure(
+        lambda: render_bubble(markdown_tokens[:BUBBLE_SHORT_TOKENS]), repeat)
+    results[f"transcript.stream_render_bubble[{STREAM_TOKENS}]"] = measure(
+        lambda: render_bubble(markdown_tokens), repeat)
+    manager.store.conn.close()
+    return results
+
+
+# ========== 冷启动：新进程中导入main.py的耗时，以及是否带入了延迟导入的模块 ==========
+STARTUP_PROBE = ("import sys, json, main; print(json.dumps({'imports_ms': main.STARTUP.marks['imports'], "
+                 "'deferred_loaded': [name for name in ('aiohttp', 'plyer') if name in sys.modules]}))")
+
+
+def bench_startup(repeat):
+    env = dict(os.environ, KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1",
+               KIVY_HOME=os.path.join(tempfile.gettempdir(), "grokchat-bench-kivy"))
+    samples = []
+    wall = []
+    probe = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        done = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=ROOT, env=env, capture_output=True,
+                              text=True)
+        wall.append((time.perf_counter() - started) * 1000)
+        if done.returncode != 0:
+            return {}, done.stderr.strip().splitlines()[-1] if done.stderr.strip() else f"退出码{done.returncode}"
+        probe = json.loads(done.stdout.strip().splitlines()[-1])
+        samples.append(probe["imports_ms"])
+    return {
+        "startup.import_main": {
+            "runs": repeat,
+            "min_ms": min(samples),
+            "median_ms": statistics.median(samples),
+            "max_ms": max(samples),
+            "deferred_loaded": probe["deferred_loaded"]
+        },
+        "startup.process_import": {
+            "runs": repeat,
+            "min_ms": min(wall),
+            "median_ms": statistics.median(wall),
+            "max_ms": max(wall)
+        }
+    }, None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    groups = set(args.only.split(",")) if args.only else {"check", "session", "sse", "stream", "transcript", "startup"}
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": time.strftime("%Y-%m-%d %H:%M:%S")
+        },
+        "results": {},
+        "checks": [],
+        "skipped": {}
+    }
+    main = None
+    if groups & {"stream", "transcript"}:
+        main, reason = load_main()
+        if main is None:
+            for group in groups & {"stream", "transcript"}:
+                report["skipped"][group] = reason
+            groups -= {"stream", "transcript"}
+
+    # 单组出错时记录原因并继续；导入Kivy后stderr被转到它的日志文件，回溯写到原始stderr才能在终端看到
+    failed = []
+
+    def run_group(group, job):
+        if group not in groups:
+            return
+        try:
+            results, reason = job()
+        except Exception as e:
+            traceback.print_exc(file=sys.__stderr__)
+            failed.append(group)
+            report["skipped"][group] = f"出错 {type(e).__name__}: {e}"
+            return
+        report["results"].update(results)
+        if reason:
+            report["skipped"][group] = reason
+
+    # 先核对解析器的正确性，计时只对正确的实现有意义
+    def checks():
+        report["checks"] = run_checks()
+        return {}, None
+
+    with tempfile.TemporaryDirectory(prefix="grokchat-bench-") as workdir:
+        run_group("check", checks)
+        run_group("session", lambda: (bench_session_manager(workdir, sizes, args.messages, args.repeat), None))
+        run_group("sse", lambda: (bench_sse(args.repeat), None))
+        run_group("stream", lambda: (asyncio.run(bench_stream(main, workdir, args.repeat)), None))
+        run_group("transcript", lambda: (bench_transcript(main, workdir, args.transcript_messages, args.repeat),
+                                         None))
+        run_group("startup", lambda: bench_startup(args.repeat))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, result in report["results"].items():
+        print(f"{name:50s} {result['median_ms']:10.2f} ms")
+    if report["checks"]:
+        print(f"正确性检查通过 {len(report['checks'])}项")
+    for group, reason in report["skipped"].items():
+        print(f"跳过 {group}：{reason}")
+    print(f"结果已写入 {args.output}")
+    return failed
+
+
+# ========== 对比两次结果：按中位数计算变化，超过阈值视为退化 ==========
+def compare(base_path, head_path, threshold):
+    with open(base_path, "r", encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    with open(head_path, "r", encoding="utf-8") as f:
+        head = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(set(base) | set(head)):
+        if name not in base or name not in head:
+            print(f"{name:50s} {'仅存在于' + ('新结果' if name in head else '旧结果'):>30s}")
+            continue
+        old, new = base[name]["median_ms"], head[name]["median_ms"]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  退化"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  提升"
+        print(f"{name:50s} {old:10.2f} -> {new:10.2f} ms {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="GrokChat无界面基准测试")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="会话档案规模，逗号分隔")
+    parser.add_argument("--messages", type=int, default=20, help="每个会话的消息条数")
+    parser.add_argument("--transcript-messages", type=int, default=1000, help="聊天记录基准的消息条数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="只运行部分基准：check,session,sse,stream,transcript,startup")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="对比两次结果")
+    parser.add_argument("--threshold", type=float, default=10.0, help="中位数变化超过该百分比视为退化")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+    if run(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
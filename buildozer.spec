@@ -15,11 +15,13 @@ android.api = 33          # 目标Android 14（API 33）
 android.minapi = 21       # 最低兼容Android 5.0（API 21）
 android.ndk = 25b         
 
-# 权限：仅保留网络请求必需的INTERNET（符合Android 14规范）
-android.permissions = INTERNET
+# 权限：网络请求必需的INTERNET；存储权限只在Android 10及以下声明（导出备份写到公共下载目录）
+android.permissions = INTERNET, (name=android.permission.WRITE_EXTERNAL_STORAGE;maxSdkVersion=29)
+# Android 10按路径写公共目录需关闭分区存储（requestLegacyExternalStorage），Android 11起忽略此属性
+android.extra_manifest_application_arguments = ./android_manifest_application.xml
 
 # 依赖（版本适配Android 14）
-requirements = python3,kivy==2.3.0,aiohttp==3.9.1,plyer==2.1.0,python-dotenv==1.0.0
+requirements = python3,sqlite3,kivy==2.3.0,aiohttp==3.9.1,plyer==2.1.0,python-dotenv==1.0.0
 
 # 屏幕配置（微信风格竖屏）
 android.fullscreen = 0
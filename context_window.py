@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上下文窗口组装（按token预算，替代固定保留20条）
+优化点：1. 始终保留system prompt 2. 从最新一轮往前填充，直到预算用完 3. 每条消息的token数只估算一次（存库缓存）
+"""
+import math
+import re
+
+# 各模型单次请求的上下文预算（token数，含system prompt和本次提问）
+MODEL_CONTEXT_BUDGETS = {
+    "grok-1": 6000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+# 每条消息的格式开销（role等字段）
+MESSAGE_OVERHEAD_TOKENS = 4
+# 中日韩字符大致一字一token，其余文本约4个字符一个token
+CJK_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    other = CJK_RE.sub("", text)
+    return (len(text) - len(other)) + math.ceil(len(other) / 4) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_budget(model):
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+
+# history为从新到旧的 (role, content, tokens)，读到预算用完即停止，不会遍历整段历史
+def assemble_context(system_prompt, history, user_msg, budget):
+    remaining = budget - estimate_tokens(user_msg)
+    if system_prompt:
+        remaining -= estimate_tokens(system_prompt)
+    picked = []
+    for role, content, tokens in history:
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        picked.append({"role": "assistant" if role == "grok" else role, "content": content})
+    # 预算在一轮对话中间用完时，最早的回复对应的提问没放进来，丢掉这条孤立的回复
+    while picked and picked[-1]["role"] == "assistant":
+        picked.pop()
+    picked.reverse()
+
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend(picked)
+    messages.append({"role": "user", "content": user_msg})
+    return messages
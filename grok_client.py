@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grok API客户端（与界面无关）
+优化点：1. App生命周期内复用同一个aiohttp会话（连接池 + DNS缓存 + keep-alive）
+        2. 输入框获得焦点时预热连接 3. 统计首token耗时（TTFT）
+        4. 独立网络线程运行事件循环，请求数有上限且可取消 5. 错误分类 + 指数退避重试策略
+        6. 请求各阶段（DNS/建连/响应头）打点，写入调用方传入的trace 7. aiohttp在首次请求时才导入，不拖慢冷启动
+        8. 一次流式对话的完整流程（发请求、查状态码、解析SSE、统计TTFT）收在stream_chat里，App和批量运行共用
+        9. 令牌桶限流：按每分钟请求数/token数放行，收到429时整体暂停到Retry-After之后
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+import email.utils
+from sse_decoder import ChatStreamParser
+from perf_metrics import NULL_TRACE
+
+aiohttp = None  # 首次建会话时由load_aiohttp导入（在网络线程中，不占用界面线程的启动时间）
+
+DEFAULT_MODEL = "grok-1"
+DEFAULT_API_URL = "https://api.x.ai/v1/chat/completions"
+
+# 连接池配置
+POOL_LIMIT = 8  # 总连接数上限
+POOL_LIMIT_PER_HOST = 4  # 单个API地址的连接数上限
+DNS_CACHE_TTL = 300  # DNS缓存时间（秒）
+KEEPALIVE_TIMEOUT = 60  # 空闲连接保活时间（秒）
+REQUEST_TIMEOUT = 30  # 单次请求超时（秒）
+MAX_PENDING_REQUESTS = 4  # 网络线程中同时排队/执行的请求上限
+
+# 重试策略（指数退避 + 全抖动）
+RETRY_BASE_DELAY = 2  # 首次重试基准间隔（秒）
+RETRY_MAX_DELAY = 300  # 重试间隔上限（秒）
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+# 请求失败：message为展示给用户的提示，retryable表示是否值得自动重试
+class ChatRequestError(Exception):
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    # Retry-After可以是秒数，也可以是HTTP日期
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - time.time())
+
+
+def status_error(status, headers=None):
+    if status == 401:
+        return ChatRequestError("API密钥无效或无访问权限（需X Premium+）", status)
+    if status == 403:
+        return ChatRequestError("当前地区不支持访问该API", status)
+    if status == 429:
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        return ChatRequestError("请求过于频繁，请稍后重试", status, True, retry_after)
+    return ChatRequestError(f"请求失败：{status}（请检查API地址）", status, status in RETRYABLE_STATUS)
+
+
+# ========== 优化2：分类异常提示（网络类错误都可重试） ==========
+def classify_error(exc):
+    if isinstance(exc, ChatRequestError):
+        return exc
+    # 还没发出过请求时aiohttp尚未导入，异常也不可能来自它
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientConnectorError):
+        return ChatRequestError("无法连接服务器，请检查网络或API地址", retryable=True)
+    if isinstance(exc, asyncio.TimeoutError):
+        return ChatRequestError("请求超时，请检查网络或稍后重试", retryable=True)
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientError):
+        return ChatRequestError(f"网络请求错误：{type(exc).__name__}", retryable=True)
+    return ChatRequestError(f"未知错误：{type(exc).__name__}（请检查API配置）")
+
+
+def retry_delay(attempts, retry_after=None):
+    # 服务端给出Retry-After时以它为准，否则指数退避并加全抖动，避免多条消息同时重试
+    if retry_after is not None:
+        return min(RETRY_MAX_DELAY, retry_after)
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempts))
+    return random.uniform(RETRY_BASE_DELAY / 2, ceiling)
+
+
+def load_aiohttp():
+    global aiohttp
+    if aiohttp is None:
+        import aiohttp as module
+        aiohttp = module
+    return aiohttp
+
+
+# ========== 请求阶段打点：aiohttp回调把时间点写入请求携带的trace ==========
+def make_trace_config():
+    config = aiohttp.TraceConfig()
+
+    def marker(name):
+        async def on_event(session, context, params):
+            trace = context.trace_request_ctx
+            if trace is not None:
+                trace.mark(name)
+        return on_event
+
+    config.on_request_start.append(marker("request_start"))
+    config.on_dns_resolvehost_start.append(marker("dns_start"))
+    config.on_dns_resolvehost_end.append(marker("dns_end"))
+    config.on_dns_cache_hit.append(marker("dns_cache_hit"))
+    config.on_connection_create_start.append(marker("connect_start"))
+    config.on_connection_create_end.append(marker("connect_end"))
+    config.on_connection_reuseconn.append(marker("connection_reused"))
+    config.on_request_end.append(marker("headers"))
+    return config
+
+
+class ChatClient:
+    def __init__(self, pool_limit=POOL_LIMIT, limit_per_host=POOL_LIMIT_PER_HOST,
+                 dns_cache_ttl=DNS_CACHE_TTL, keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.pool_limit = pool_limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.last_prewarm = 0
+        # 首token耗时统计（毫秒）
+        self.stats = {"requests": 0, "ttft_count": 0, "ttft_total_ms": 0.0, "last_ttft_ms": None}
+
+    # 会话必须在事件循环内创建，首次使用时再建
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            load_aiohttp()
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self.session = aiohttp.ClientSession(connector=connector, trace_configs=[make_trace_config()])
+        return self.session
+
+    # ========== 连接预热：提前完成DNS/TCP/TLS握手，连接留在池中供下次请求复用 ==========
+    async def prewarm(self, url):
+        now = time.monotonic()
+        # 连接仍在保活期内则无需重复预热
+        if now - self.last_prewarm < self.keepalive_timeout / 2:
+            return
+        self.last_prewarm = now
+        try:
+            async with self.get_session().head(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                await response.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    # trace：perf_metrics.Trace，为None时不打点
+    def post_chat(self, url, api_key, payload, timeout=REQUEST_TIMEOUT, trace=None):
+        self.stats["requests"] += 1
+        return self.get_session().post(
+            url,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            trace_request_ctx=trace
+        )
+
+    def record_ttft(self, started):
+        # started为time.perf_counter()取得的请求开始时间
+        ttft_ms = (time.perf_counter() - started) * 1000
+        self.stats["ttft_count"] += 1
+        self.stats["ttft_total_ms"] += ttft_ms
+        self.stats["last_ttft_ms"] = ttft_ms
+        return ttft_ms
+
+    def average_ttft_ms(self):
+        if not self.stats["ttft_count"]:
+            return None
+        return self.stats["ttft_total_ms"] / self.stats["ttft_count"]
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+# ========== 流式对话：逐段回调on_token，返回完整回复和本次请求的统计 ==========
+async def stream_chat(client, url, api_key, messages, on_token=None, model=DEFAULT_MODEL, trace=NULL_TRACE,
+                      timeout=REQUEST_TIMEOUT):
+    payload = {"model": model, "messages": messages, "stream": True}
+    if trace.enabled:
+        trace.count("request_bytes", len(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+
+    request_started = time.perf_counter()
+    result = {"reply": "", "ttft_ms": None, "tokens": 0, "sse_errors": 0, "last_error": None}
+    parts = []
+    async with client.post_chat(url, api_key, payload, timeout=timeout,
+                                trace=trace if trace.enabled else None) as response:
+        # 状态码异常处理
+        if response.status != 200:
+            raise status_error(response.status, response.headers)
+
+        # 流式读取响应：按到达的原始字节块解码，事件跨块、多行data都能正确拼接
+        parser = ChatStreamParser()
+
+        def emit(contents):
+            for content in contents:
+                if result["ttft_ms"] is None:
+                    trace.mark("first_token")
+                    result["ttft_ms"] = client.record_ttft(request_started)
+                trace.count("tokens")
+                result["tokens"] += 1
+                parts.append(content)
+                if on_token is not None:
+                    on_token(content)
+
+        async for chunk in response.content.iter_any():
+            if trace.enabled:
+                trace.count("response_bytes", len(chunk))
+                chunk_started = time.perf_counter()
+            emit(parser.feed(chunk))
+            if trace.enabled:
+                trace.add("parse", time.perf_counter() - chunk_started)
+            if parser.done:
+                break
+        # 流末尾才完成的事件（如最后一行以单独\r结尾）
+        emit(parser.close())
+
+    trace.mark("stream_end")
+    if parser.ignored:
+        trace.count("sse_ignored", parser.ignored)
+    if parser.errors:
+        trace.count("sse_errors", parser.errors)
+        result["sse_errors"] = parser.errors
+        result["last_error"] = parser.last_error
+    result["reply"] = "".join(parts)
+    return result
+
+
+# ========== 令牌桶：rate为每秒补充量，capacity为允许的突发量；rate为None时只受429暂停约束 ==========
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()  # 等待者按先来后到放行
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.rate is None:
+                    return
+                self.refill(now)
+                needed = min(amount, self.capacity)  # 超过突发量的单次请求攒满即放行，不会永远等下去
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    # 事后补扣（如回复实际消耗的token），余额可以为负，后面的请求相应多等
+    def charge(self, amount):
+        if self.rate is not None:
+            self.refill(time.monotonic())
+            self.tokens -= amount
+
+    # 收到429：清空余额并暂停放行，直到服务端给出的时间之后
+    def pause(self, seconds):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.refill(now)
+            self.tokens = min(self.tokens, 0)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+# ========== 网络运行时：后台线程 + 独立事件循环，界面线程只负责提交和取消 ==========
+class NetworkRuntime:
+    def __init__(self, max_pending=MAX_PENDING_REQUESTS):
+        self.max_pending = max_pending
+        self.loop = asyncio.new_event_loop()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run_loop, name="grok-network", daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # 提交协程，返回concurrent.futures.Future；队列已满返回None
+    def submit(self, coro, bounded=True):
+        with self.lock:
+            if bounded and len(self.pending) >= self.max_pending:
+                coro.close()
+                return None
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+            self.pending.add(future)
+        future.add_done_callback(self.discard)
+        return future
+
+    def discard(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def cancel(self, future):
+        # 取消会传递到事件循环中的任务，在其当前await处抛出CancelledError
+        if future is not None and not future.done():
+            future.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            futures = list(self.pending)
+        for future in futures:
+            self.cancel(future)
+
+    def stop(self, client=None, timeout=2):
+        self.cancel_all()
+        if client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(client.close(), self.loop).result(timeout)
+            except Exception:
+                pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
@@ -2,45 +2,92 @@
 # -*- coding: utf-8 -*-
 """
 Grok聊天APP（适配Android 14 + 体验优化版）
-优化点：1. 自定义API地址 2. 分类异常提示 3. 系统提示初始化
+优化点：1. 自定义API地址 2. 分类异常提示 3. 系统提示初始化 4. 聊天记录回收复用渲染（RecycleView）
+        5. 会话列表按会话ID增量更新 6. 流式回复合并刷新（每帧最多一次，只重排尾部段落）
+        7. 网络请求在独立线程的事件循环中执行，支持停止时取消 8. 全部会话全文搜索，结果直达对应消息
+        9. 发送队列持久化，断网/限流自动退避重试，回复写回所属会话 10. 按会话开启本地回复缓存，相同上下文直接回放
+        11. 可选性能埋点：每条回复各阶段耗时、token速率、帧耗时写入滚动日志，调试浮层显示摘要
+        12. 长期未打开的会话压缩归档，点开时自动恢复；存储占用报告
+        13. 多个会话同时生成回复（全局并发有上限），切走的会话在后台缓冲，切回时接着显示，会话列表显示生成进度
+        14. 分阶段冷启动：首帧只显示界面骨架，配置和会话在后台加载；网络库、剪贴板首次使用时才导入；记录各阶段耗时
+        15. 回复按Markdown渲染（代码块、列表、标题等，方括号正确转义），流式时只重新解析末尾未完成的块；markup与高度按消息缓存
+        16. 会话档案流式导出/导入（JSONL或压缩二进制），导入按会话ID合并、按消息哈希去重
+        17. 请求流程与界面解耦（grok_client.stream_chat），同一套逻辑可由batch_runner.py在命令行批量运行
 """
+import time
+STARTED = time.perf_counter()  # 启动耗时以开始导入的时刻为零点，放在其它导入之前
 import json
-import asyncio
-import aiohttp
 import datetime
 import os
+import asyncio
+import threading
+from collections import OrderedDict
 from kivy.app import App
+from kivy.uix.widget import Widget
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.scrollview import ScrollView
 from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
-from kivy.uix.gridlayout import GridLayout
+from kivy.uix.togglebutton import ToggleButton
 from kivy.uix.popup import Popup
 from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.graphics import Color, RoundedRectangle
 from kivy.core.window import Window
-from kivy.clock import mainthread
-from plyer import clipboard
+from kivy.core.text.markup import MarkupLabel
+from kivy.clock import Clock, mainthread
+from kivy.logger import Logger
+from kivy.utils import platform
+from session_store import SessionManager, SessionStore, cold_cutoff
+from session_transfer import export_archive, import_archive, TransferError
+from response_cache import ResponseCache
+from perf_metrics import PerfRecorder, StartupProfile, NULL_TRACE, format_summary
+from reply_manager import ReplyManager
+from markdown_markup import MarkdownStream, render_markdown, render_block, escape as escape_markup
+from grok_client import (ChatClient, NetworkRuntime, DEFAULT_MODEL, DEFAULT_API_URL, stream_chat, classify_error,
+                         retry_delay)
 
 # 全局配置
 WINDOW_WIDTH = Window.width
 WINDOW_HEIGHT = Window.height
+# 聊天记录分页：打开会话只加载最近一页，滑到顶部再加载更早的消息
+MESSAGE_PAGE_SIZE = 50
+# 冷会话归档：超过天数未打开也没有新消息的会话压缩保存；启动后在后台线程逐个进行，避免卡顿
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_START_DELAY = 10  # 启动后多久开始（秒）
+# 流式回复刷新间隔（秒）：0表示每帧最多刷新一次
+STREAM_FLUSH_INTERVAL = 0
+REPLY_PROGRESS_INTERVAL = 0.5  # 会话列表中回复进度的刷新间隔（秒）
+# 命中缓存时按块回放，保持与流式回复一致的显示方式
+CACHE_REPLAY_CHUNK = 64
+# 冷启动各阶段耗时，导入完成是第一个时间点
+STARTUP = StartupProfile(STARTED)
+STARTUP.mark("imports")
 
 # ========== 适配Android 14：Kivy私有目录 ==========
 DATA_DIR = ""  # 初始化空值，在App启动时赋值
 API_KEY_FILE = ""
 API_URL_FILE = ""  # 新增：存储自定义API地址
-SESSIONS_FILE = ""
+SESSIONS_FILE = ""  # 旧版会话文件，仅用于首次启动迁移
+SESSIONS_DB = ""  # 会话存储（SQLite WAL）
+RESPONSE_CACHE_DB = ""  # 回复缓存（可随时删除）
+PERF_FILE = ""  # 性能埋点开关
+PERF_LOG = ""  # 性能埋点日志（JSONL，按大小滚动）
 
 # 初始化默认数据（新增API地址配置）
 def init_default_data(app_instance):
-    global DATA_DIR, API_KEY_FILE, API_URL_FILE, SESSIONS_FILE
+    global DATA_DIR, API_KEY_FILE, API_URL_FILE, SESSIONS_FILE, SESSIONS_DB, RESPONSE_CACHE_DB, PERF_FILE, PERF_LOG
     # 赋值为App的私有目录（适配Android 14）
     DATA_DIR = app_instance.user_data_dir
     API_KEY_FILE = os.path.join(DATA_DIR, "api_key.json")
     API_URL_FILE = os.path.join(DATA_DIR, "api_url.json")  # 新增
     SESSIONS_FILE = os.path.join(DATA_DIR, "sessions.json")
+    SESSIONS_DB = os.path.join(DATA_DIR, "sessions.db")
+    RESPONSE_CACHE_DB = os.path.join(DATA_DIR, "response_cache.db")
+    PERF_FILE = os.path.join(DATA_DIR, "perf.json")
+    PERF_LOG = os.path.join(DATA_DIR, "perf_metrics.jsonl")
     
     # 确保目录存在（私有目录无需权限）
     if not os.path.exists(DATA_DIR):
@@ -53,23 +100,8 @@ def init_default_data(app_instance):
     
     # ========== 优化1：初始化API地址文件（默认官方地址） ==========
     if not os.path.exists(API_URL_FILE):
-        default_api_url = "https://api.x.ai/v1/chat/completions"
         with open(API_URL_FILE, "w", encoding="utf-8") as f:
-            json.dump({"api_url": default_api_url}, f)
-    
-    # ========== 优化3：初始化会话文件（加入system prompt） ==========
-    if not os.path.exists(SESSIONS_FILE):
-        default_session = {
-            "id": "default",
-            "name": "默认会话",
-            "last_msg": "暂无消息",
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-            "messages": [],
-            # 新增system prompt（Grok-1支持则生效，不支持则忽略）
-            "context": [{"role": "system", "content": "You are a helpful assistant. Answer questions clearly and concisely."}]
-        }
-        with open(SESSIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"current_session": "default", "sessions": [default_session]}, f)
+            json.dump({"api_url": DEFAULT_API_URL}, f)
 
 # 读取API密钥
 def get_api_key():
@@ -92,105 +124,148 @@ def save_api_url(api_url):
     with open(API_URL_FILE, "w", encoding="utf-8") as f:
         json.dump({"api_url": api_url}, f)
 
-# 会话管理类（无修改，保持原有功能）
-class SessionManager:
-    def __init__(self):
-        self.load_sessions()
-
-    def load_sessions(self):
-        with open(SESSIONS_FILE, "r", encoding="utf-8") as f:
-            self.data = json.load(f)
-        self.current_session_id = self.data["current_session"]
-        self.sessions = self.data["sessions"]
-
-    def save_sessions(self):
-        self.data["current_session"] = self.current_session_id
-        self.data["sessions"] = self.sessions
-        with open(SESSIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
-
-    def get_current_session(self):
-        return next(s for s in self.sessions if s["id"] == self.current_session_id)
-
-    def create_session(self, first_msg="新会话"):
-        session_id = f"session_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-        new_session = {
-            "id": session_id,
-            "name": first_msg[:20],
-            "last_msg": first_msg[:30],
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-            "messages": [],
-            # 新会话也加入system prompt
-            "context": [{"role": "system", "content": "You are a helpful assistant. Answer questions clearly and concisely."}]
-        }
-        self.sessions.append(new_session)
-        self.current_session_id = session_id
-        self.save_sessions()
-        return session_id
+# ========== 优化11：性能埋点开关（默认关闭） ==========
+def get_perf_enabled():
+    if not os.path.exists(PERF_FILE):
+        return False
+    with open(PERF_FILE, "r", encoding="utf-8") as f:
+        return json.load(f).get("enabled", False)
 
-    def rename_session(self, session_id, new_name):
-        session = next(s for s in self.sessions if s["id"] == session_id)
-        session["name"] = new_name
-        self.save_sessions()
+def save_perf_enabled(enabled):
+    with open(PERF_FILE, "w", encoding="utf-8") as f:
+        json.dump({"enabled": enabled}, f)
 
-    def delete_session(self, session_id):
-        if session_id == "default":
-            return False
-        self.sessions = [s for s in self.sessions if s["id"] != session_id]
-        self.current_session_id = "default"
-        self.save_sessions()
-        return True
+def file_size(path):
+    total = 0
+    for suffix in ("", "-wal", "-shm", ".1", ".2", ".3"):
+        if os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total
 
-    def update_session_msg(self, session_id, user_msg, grok_msg):
-        session = next(s for s in self.sessions if s["id"] == session_id)
-        session["messages"].append({
-            "role": "user",
-            "content": user_msg,
-            "time": datetime.datetime.now().strftime("%H:%M")
-        })
-        session["messages"].append({
-            "role": "grok",
-            "content": grok_msg,
-            "time": datetime.datetime.now().strftime("%H:%M")
-        })
-        session["context"].append({"role": "user", "content": user_msg})
-        session["context"].append({"role": "assistant", "content": grok_msg})
-        if len(session["context"]) > 20:
-            session["context"] = session["context"][-20:]
-        session["last_msg"] = user_msg[:30]
-        session["timestamp"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-        self.save_sessions()
-
-# 消息气泡组件（无修改）
-class MessageBubble(Label):
-    def __init__(self, content, role, time, **kwargs):
-        super().__init__(**kwargs)
-        self.content = content
-        self.role = role
-        self.time = time
-        self.font_size = 14
-        self.size_hint_y = None
-        self.bind(texture_size=self.setter('size'))
-        self.padding = [10, 8, 10, 8]
-        self.markup = True
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+# 气泡内边距；流式回复的已完成块单独一个Label，下边距留给其下方的尾部Label，
+# 尾部Label没有上边距，两块之间的空行写在尾部markup开头，两个Label合起来与整条渲染等高
+BUBBLE_PADDING = [10, 8, 10, 8]
+FROZEN_PADDING = [10, 8, 10, 0]
+TAIL_PADDING = [10, 0, 10, 8]
+
+def time_markup(time):
+    return f"[size=10][color=#666666]{time}[/color][/size]"
 
+# 气泡文本（正文 + 时间）：回复按Markdown渲染，提问只做转义
+def bubble_markup(content, role, time):
+    text = render_markdown(content) if role == "grok" else escape_markup(content)
+    if not time:
+        return text
+    return f"{text}\n{time_markup(time)}"
+
+# ========== 优化4：气泡markup只解析一次、高度只测量一次（不生成纹理），按消息ID缓存 ==========
+class BubbleLayoutCache:
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.heights = OrderedDict()
+        self.markups = OrderedDict()  # msg_id -> (原文, markup)，原文不同视为失效（ID被复用）
+        self.line_heights = {}  # width -> 单行文字气泡的高度
+
+    def markup(self, msg_id, content, role, time):
+        if msg_id is None:
+            return bubble_markup(content, role, time)
+        cached = self.markups.get(msg_id)
+        if cached is not None and cached[0] == content:
+            self.markups.move_to_end(msg_id)
+            return cached[1]
+        markup = bubble_markup(content, role, time)
+        self.markups[msg_id] = (content, markup)
+        if len(self.markups) > self.capacity:
+            self.markups.popitem(last=False)
+        return markup
+
+    @staticmethod
+    def measure(text, width, padding=BUBBLE_PADDING):
+        label = MarkupLabel(text=text, font_size=14, padding=padding, text_size=(width, None))
+        label.resolve_font_name()
+        return label.render()[1]
+
+    # 在已测量高度为upper的内容下方接上separator + lower后的高度：只测量lower（内边距相互抵消，与upper的无关）。
+    # 行高与上下文有关（如小字号的时间行单独测量时更矮），所以在一行占位文字下方测量再减去占位行
+    def stack(self, upper, separator, lower, width):
+        if width not in self.line_heights:
+            self.line_heights[width] = self.measure("a", width)
+        return upper + self.measure(f"a{separator}{lower}", width) - self.line_heights[width]
+
+    def height(self, msg_id, text, width):
+        # 未落库的消息（刚发送/流式中）没有ID，内容还会变化，不缓存
+        if msg_id is None:
+            return self.measure(text, width)
+        key = (msg_id, width)
+        if key in self.heights:
+            self.heights.move_to_end(key)
+            return self.heights[key]
+        height = self.measure(text, width)
+        self.heights[key] = height
+        if len(self.heights) > self.capacity:
+            self.heights.popitem(last=False)
+        return height
+
+bubble_layout_cache = BubbleLayoutCache()
+
+# 消息气泡组件（由MessageRow复用，切换数据时更新内容和配色）
+# 一个背景、两个Label：frozen_label显示流式回复中已完成的块，只在有块完成时改变；
+# text_label显示普通消息的全文，或流式回复的尾部块+时间，流式刷新时只有它重新排版
+class MessageBubble(Widget):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.content = ""
+        self.role = "grok"
+        self.frozen_height = 0
         with self.canvas.before:
-            if role == "user":
-                Color(0.2, 0.5, 0.9, 1)
-                self.rect = RoundedRectangle(radius=[10, 10, 0, 10], size=self.size, pos=self.pos)
-            else:
-                Color(0.85, 0.85, 0.85, 1)
-                self.rect = RoundedRectangle(radius=[10, 10, 10, 0], size=self.size, pos=self.pos)
+            self.rect_color = Color(0.85, 0.85, 0.85, 1)
+            self.rect = RoundedRectangle(radius=[10, 10, 10, 0], size=self.size, pos=self.pos)
+        self.frozen_label = Label(font_size=14, padding=FROZEN_PADDING, markup=True, size_hint=(None, None))
+        self.text_label = Label(font_size=14, padding=BUBBLE_PADDING, markup=True, size_hint=(None, None))
+        self.add_widget(self.frozen_label)
+        self.add_widget(self.text_label)
         self.bind(size=self.update_rect, pos=self.update_rect)
 
-        self.text = f"{content}\n[size=10][color=#666666]{time}[/color][/size]"
-
         self.register_event_type('on_long_touch')
         self.last_touch_down = None
 
+    # markup和高度由行数据预先生成，复用控件时不再解析；文字没变的Label不会重新排版
+    def set_message(self, content, role, markup, frozen_markup="", frozen_height=0):
+        self.content = content
+        self.role = role
+        if role == "user":
+            self.rect_color.rgba = (0.2, 0.5, 0.9, 1)
+            self.rect.radius = [10, 10, 0, 10]
+            halign = "right"
+        else:
+            self.rect_color.rgba = (0.85, 0.85, 0.85, 1)
+            self.rect.radius = [10, 10, 10, 0]
+            halign = "left"
+        for label in (self.frozen_label, self.text_label):
+            label.halign = halign
+        self.text_label.padding = TAIL_PADDING if frozen_markup else BUBBLE_PADDING
+        self.frozen_label.text = frozen_markup
+        self.text_label.text = markup
+        self.frozen_height = frozen_height
+        self.update_rect()
+
     def update_rect(self, *args):
         self.rect.pos = self.pos
         self.rect.size = self.size
+        # 已完成块贴顶，尾部占余下的高度；只改位置和大小不会重新生成纹理
+        self.frozen_label.size = (self.width, self.frozen_height)
+        self.frozen_label.pos = (self.x, self.top - self.frozen_height)
+        self.text_label.size = (self.width, self.height - self.frozen_height)
+        self.text_label.pos = self.pos
+        for label in (self.frozen_label, self.text_label):
+            label.text_size = (self.width, None)
 
     def on_touch_down(self, touch):
         if self.collide_point(*touch.pos):
@@ -207,67 +282,515 @@ class MessageBubble(Label):
         return super().on_touch_up(touch)
 
     def on_long_touch(self):
+        # 复制整条消息的原文；plyer按平台加载实现，首次复制时再导入
+        from plyer import clipboard
         clipboard.copy(self.content)
         popup = Popup(title="提示", content=Label(text="已复制消息内容"), size_hint=(0.6, 0.3))
         popup.open()
-        asyncio.run_coroutine_threadsafe(self.close_popup(popup), asyncio.get_event_loop())
+        Clock.schedule_once(lambda dt: popup.dismiss(), 2)
 
-    async def close_popup(self, popup):
-        await asyncio.sleep(2)
-        popup.dismiss()
+# 聊天记录中的一行：只在可见区域内实例化，滚动时复用
+class MessageRow(RecycleDataViewBehavior, FloatLayout):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bubble = MessageBubble(size_hint=(None, None))
+        self.add_widget(self.bubble)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.bubble.size = (data["bubble_width"], data["height"])
+        self.bubble.set_message(data["content"], data["role"], data["markup"],
+                                data["frozen_markup"], data["frozen_height"])
+        # FloatLayout只按pos_hint摆放子控件，y也要给出，否则气泡留在y=0而不跟随行
+        self.bubble.pos_hint = {"right": 1, "y": 0} if data["role"] == "user" else {"x": 0, "y": 0}
+        return super().refresh_view_attrs(rv, index, data)
+
+# ========== 优化4：聊天记录视图（只渲染可见行，上滑到顶部加载更早消息） ==========
+class ChatTranscript(RecycleView):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.layout = RecycleBoxLayout(orientation="vertical", spacing=10, padding=[10, 10, 10, 10],
+                                       default_size=(None, 56), default_size_hint=(1, None), size_hint_y=None)
+        self.layout.bind(minimum_height=self.layout.setter('height'))
+        self.add_widget(self.layout)
+        # viewclass存在layout上，要在添加layout之后设置，否则被忽略
+        self.viewclass = MessageRow
+        self.load_older = None  # 由App设置：加载更早一页消息的回调
+        self.load_newer = None  # 由App设置：从搜索结果跳入时，向下加载更新消息的回调
+        self.loading_older = False
+        self.loading_newer = False
+        self.bind(scroll_y=self.on_scroll_position)
+
+    def on_scroll_position(self, instance, scroll_y):
+        if scroll_y >= 1 and self.load_older and not self.loading_older and self.data:
+            self.loading_older = True
+            Clock.schedule_once(self.do_load_older, 0)
+        elif scroll_y <= 0 and self.load_newer and not self.loading_newer and self.data:
+            self.loading_newer = True
+            Clock.schedule_once(self.do_load_newer, 0)
+
+    def do_load_newer(self, dt):
+        # 新消息追加在底部，不影响当前可见位置
+        self.load_newer()
+        self.loading_newer = False
+
+    def do_load_older(self, dt):
+        added_height = self.load_older()
+        if added_height:
+            # 保持当前可见的消息不跳动：按新增高度换算滚动位置
+            Clock.schedule_once(lambda dt: self.keep_position(added_height), 0)
+        self.loading_older = False
+
+    def keep_position(self, added_height):
+        scrollable = self.layout.height - self.height
+        if scrollable > 0:
+            self.scroll_y = max(0, min(1, 1 - added_height / scrollable))
+
+    def scroll_to_row(self, index):
+        def scroll(dt):
+            scrollable = self.layout.height - self.height
+            if scrollable <= 0:
+                return
+            offset = self.layout.padding[1] + sum(row["height"] for row in self.data[:index]) \
+                + self.layout.spacing * index
+            self.scroll_y = max(0, min(1, 1 - offset / scrollable))
+        Clock.schedule_once(scroll, 0)
+
+    def scroll_to_newest(self):
+        # 等布局刷新后再滚动，否则新高度尚未生效
+        Clock.schedule_once(lambda dt: setattr(self, "scroll_y", 0), 0)
+
+    def find_row(self, row):
+        # 新行总是追加在末尾，从后往前按对象身份查找
+        for index in range(len(self.data) - 1, -1, -1):
+            if self.data[index] is row:
+                return index
+        return -1
+
+    def make_row(self, content, role, time, msg_id=None):
+        width = WINDOW_WIDTH * 0.5
+        markup = bubble_layout_cache.markup(msg_id, content, role, time)
+        return {
+            "msg_id": msg_id,
+            "content": content,
+            "role": role,
+            "time": time,
+            "markup": markup,
+            "frozen_markup": "",  # 流式回复中已完成块的markup和高度，普通消息为空
+            "frozen_height": 0,
+            "bubble_width": width,
+            "height": bubble_layout_cache.height(msg_id, markup, width)
+        }
+
+    def append_row(self, content, role, time):
+        row = self.make_row(content, role, time)
+        self.data.append(row)
+        return row
+
+    def set_row_content(self, row, content):
+        # 会话已切走时找不到该行，直接忽略
+        index = self.find_row(row)
+        if index < 0:
+            return
+        row["content"] = content
+        row["markup"] = bubble_markup(content, row["role"], row["time"])
+        row["frozen_markup"] = ""
+        row["frozen_height"] = 0
+        row["height"] = bubble_layout_cache.height(None, row["markup"], row["bubble_width"])
+        # 重新赋值触发RecycleView只刷新这一行
+        self.data[index] = row
+        self.scroll_to_newest()
+
+    # 流式回复：已完成块与尾部的markup和高度由调用方算好，分别显示在气泡的两个Label中
+    def set_row_parts(self, row, content, frozen_markup, frozen_height, markup, height):
+        index = self.find_row(row)
+        if index < 0:
+            return
+        row["content"] = content
+        row["frozen_markup"] = frozen_markup
+        row["frozen_height"] = frozen_height
+        row["markup"] = markup
+        row["height"] = frozen_height + height
+        self.data[index] = row
+        self.scroll_to_newest()
+
+# ========== 优化6：流式回复渲染器 ==========
+# token追加到列表（O(1)），由Clock合并为每帧最多一次刷新；整条回复始终是一个气泡。
+# 已完成的Markdown块（空行或代码围栏闭合处结束）的markup和高度只算一次并缓存，显示在气泡上部单独的Label中，
+# 只在有块完成时改变；每次刷新只重新解析、测量、排版尾部未完成的块
+class StreamRenderer:
+    def __init__(self, transcript, row, interval=STREAM_FLUSH_INTERVAL, trace=NULL_TRACE):
+        self.transcript = transcript
+        self.row = row  # 当前尾部行
+        self.interval = interval
+        self.trace = trace
+        self.parts = []  # 全部token，结束时只join一次
+        self.shown = 0  # 已刷新到界面的token数；网络线程只追加，主线程按下标取新增部分，互不丢失
+        self.content = ""  # 已刷新部分的原文，每次刷新只接上新增部分
+        self.received = 0  # 已收到的字数，供会话列表显示进度
+        self.blocks = MarkdownStream()  # 增量切块，blocks.tail为尾部未完成的块
+        self.frozen = ""  # 已完成块的markup（不含时间）
+        self.frozen_height = 0  # 已完成块的高度（含内边距）
+        self.scheduled = False
+        self.closed = False
+
+    def append(self, token):
+        if self.closed:
+            return
+        self.parts.append(token)
+        self.received += len(token)
+        if not self.scheduled:
+            self.scheduled = True
+            Clock.schedule_once(self.flush, self.interval)
+
+    def attached(self):
+        return self.row is not None and self.transcript.find_row(self.row) >= 0
+
+    def flush(self, *args):
+        self.scheduled = False
+        end = len(self.parts)
+        if end == self.shown:
+            return
+        pending = self.parts[self.shown:end]
+        self.shown = end
+        # 所属会话不在屏幕上时只累积文本，不动界面
+        if not self.attached():
+            return
+        if self.trace.enabled:
+            with self.trace.span("render"):
+                self.render(pending)
+            self.trace.count("flushes")
+        else:
+            self.render(pending)
+
+    def render(self, pending):
+        text = "".join(pending)
+        self.content += text
+        finished = self.blocks.feed(text)
+        if finished:
+            self.freeze(finished)
+        self.update_row()
+
+    def freeze(self, blocks):
+        markup = "\n\n".join(render_block(block) for block in blocks)
+        width = self.row["bubble_width"]
+        if self.frozen:
+            self.frozen_height = bubble_layout_cache.stack(self.frozen_height, "\n\n", markup, width)
+            self.frozen = f"{self.frozen}\n\n{markup}"
+        else:
+            self.frozen_height = bubble_layout_cache.measure(markup, width, FROZEN_PADDING)
+            self.frozen = markup
+
+    # 气泡 = 已完成块（缓存） + 尾部块 + 时间；只测量尾部。
+    # 分隔与整条渲染相同：尾部块前空一行（整条markup中的\n\n），只有时间时直接接在下一行
+    def update_row(self):
+        if not self.frozen:
+            self.transcript.set_row_content(self.row, self.content)
+            return
+        tail = render_markdown(self.blocks.tail)
+        markup = "\n".join(part for part in (tail, time_markup(self.row["time"]) if self.row["time"] else "") if part)
+        if tail:
+            markup = "\n" + markup
+        if markup:
+            height = bubble_layout_cache.measure(markup, self.row["bubble_width"], TAIL_PADDING)
+        else:
+            height = TAIL_PADDING[3]
+        self.transcript.set_row_parts(self.row, self.content, self.frozen, self.frozen_height, markup, height)
+
+    # 切回所属会话时挂到重新加载的聊天记录末尾，已收到的内容重新切块，之后继续流式刷新
+    def attach(self, time):
+        if self.row is not None:
+            time = self.row["time"]
+        self.shown = len(self.parts)
+        self.content = "".join(self.parts[:self.shown])
+        self.blocks = MarkdownStream()
+        self.frozen = ""
+        self.frozen_height = 0
+        self.row = self.transcript.append_row("", "grok", time)
+        finished = self.blocks.feed(self.content)
+        if finished:
+            self.freeze(finished)
+        self.update_row()
+        return self.row
+
+    def finish(self):
+        # 返回完整回复；剩余token在下一帧刷新（已完成块+尾部块的markup和高度与整条解析、测量的结果相同，不必整条重排）
+        self.closed = True
+        if not self.scheduled:
+            self.scheduled = True
+            Clock.schedule_once(self.flush, 0)
+        return "".join(self.parts)
+
+    # 只在主线程的投递结束回调中调用，立即替换：重试可能马上在同一气泡行上重新开始
+    def fail(self, text):
+        # 错误提示替换整个气泡（失败时已收到的部分不保存，重试会重新生成）
+        self.closed = True
+        self.shown = len(self.parts)
+        if self.row is not None:
+            self.transcript.set_row_content(self.row, text)
+
+# 会话列表中的一行：复用的控件，数据变化时只更新文字和选中高亮
+class SessionRow(RecycleDataViewBehavior, BoxLayout):
+    def __init__(self, **kwargs):
+        super().__init__(orientation="vertical", padding=5, **kwargs)
+        self.session_id = None
+        with self.canvas.before:
+            self.highlight_color = Color(0.9, 0.9, 0.9, 0)
+            self.highlight = RoundedRectangle(size=self.size, pos=self.pos, radius=[5])
+        self.bind(size=self.update_highlight, pos=self.update_highlight)
+
+        self.name_label = Label(font_size=14, bold=True, size_hint=(1, 0.5))
+        self.preview_label = Label(font_size=12, color=(0.6, 0.6, 0.6, 1), size_hint=(1, 0.3))
+        btn_layout = BoxLayout(orientation="horizontal", size_hint=(1, 0.2), spacing=5)
+        rename_btn = Button(text="重命名", size_hint=(0.5, 1), font_size=10, background_color=(0.7, 0.7, 0.7, 1))
+        rename_btn.bind(on_press=lambda x: App.get_running_app().rename_session(self.session_id))
+        delete_btn = Button(text="删除", size_hint=(0.5, 1), font_size=10, background_color=(0.9, 0.3, 0.3, 1))
+        delete_btn.bind(on_press=lambda x: App.get_running_app().delete_session(self.session_id))
+        btn_layout.add_widget(rename_btn)
+        btn_layout.add_widget(delete_btn)
+        self.add_widget(self.name_label)
+        self.add_widget(self.preview_label)
+        self.add_widget(btn_layout)
+
+    def update_highlight(self, *args):
+        self.highlight.pos = self.pos
+        self.highlight.size = self.size
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.session_id = data["session_id"]
+        self.name_label.text = data["name"]
+        self.preview_label.text = data["preview"]
+        self.highlight_color.a = 1 if data["selected"] else 0
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_touch_down(self, touch):
+        # 按钮优先处理；点在其它区域才切换会话
+        if super().on_touch_down(touch):
+            return True
+        if self.collide_point(*touch.pos) and self.session_id:
+            App.get_running_app().switch_session(self.session_id)
+            return True
+        return False
+
+# ========== 优化5：会话列表模型（按会话ID定位行，只替换发生变化的行） ==========
+class SessionListModel:
+    def __init__(self, view, session_manager):
+        self.view = view
+        self.session_manager = session_manager
+        self.positions = {}  # session_id -> 在view.data中的下标
+        self.selected_id = None
+        self.progress = None  # 由App设置：查询会话回复进度的回调
+
+    def make_row(self, session):
+        progress = self.progress(session["id"]) if self.progress else None
+        if progress is None:
+            preview = f"{'[已归档] ' if session['archived'] else ''}{session['last_msg']} | {session['timestamp']}"
+        elif progress[0] == "queued":
+            preview = "排队中…"
+        else:
+            preview = f"生成中… {progress[1]}字"
+        return {
+            "session_id": session["id"],
+            "name": session["name"],
+            "preview": preview,
+            "selected": session["id"] == self.selected_id
+        }
+
+    def reset(self):
+        self.selected_id = self.session_manager.current_session_id
+        self.view.data = [self.make_row(s) for s in self.session_manager.sessions]
+        self.positions = {s["id"]: i for i, s in enumerate(self.session_manager.sessions)}
+
+    def update(self, session_id):
+        index = self.positions.get(session_id)
+        if index is None:
+            return
+        row = self.make_row(self.session_manager.get_session_meta(session_id))
+        if self.view.data[index] != row:
+            self.view.data[index] = row
+
+    def add(self, session_id):
+        self.positions[session_id] = len(self.view.data)
+        self.view.data.append(self.make_row(self.session_manager.get_session_meta(session_id)))
+
+    def remove(self, session_id):
+        index = self.positions.pop(session_id, None)
+        if index is None:
+            return
+        del self.view.data[index]
+        for sid, pos in self.positions.items():
+            if pos > index:
+                self.positions[sid] = pos - 1
+        if self.selected_id == session_id:
+            self.selected_id = None
+
+    def select(self, session_id):
+        previous, self.selected_id = self.selected_id, session_id
+        if previous != session_id and previous is not None:
+            self.update(previous)
+        self.update(session_id)
+
+# 搜索结果中的一行
+class SearchResultRow(RecycleDataViewBehavior, Button):
+    def __init__(self, **kwargs):
+        super().__init__(font_size=12, halign="left", valign="middle", **kwargs)
+        self.bind(size=lambda *args: setattr(self, "text_size", (self.width - 10, None)))
+        self.result = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.result = data["result"]
+        return super().refresh_view_attrs(rv, index, {"text": data["text"]})
+
+    def on_release(self):
+        App.get_running_app().open_search_result(self.result)
 
 # 主聊天界面（核心优化）
 class GrokChatApp(App):
+    # ========== 优化14：分阶段启动 ==========
+    # build只搭界面骨架（禁用状态），首帧画出后在后台线程读取配置、打开会话库、预取当前会话，再回主线程填充
     def build(self):
-        init_default_data(self)
-        self.session_manager = SessionManager()
-        self.api_key = get_api_key()
-        self.api_url = get_api_url()  # 新增：读取自定义API地址
-
-        # 检查API密钥，无则弹出输入框
-        if not self.api_key:
-            self.show_api_key_popup()
+        self.session_manager = None  # 后台加载完成前为None
+        self.api_key = ""
+        self.api_url = ""
+        # App生命周期内复用的HTTP客户端（连接池 + keep-alive），运行在独立网络线程
+        self.chat_client = ChatClient()
+        self.network = NetworkRuntime()
+        self.response_cache = None
+        self.perf = None
+        # 发送时创建的埋点记录，投递开始时取出：outbox_id -> trace
+        self.traces = {}
+        self.frame_event = None
+        # 多个会话可同时生成回复（全局有上限）；outbox_id -> 对应的回复气泡行
+        self.replies = ReplyManager()
+        self.reply_rows = {}
+        self.progress_event = None
+        self.outbox_event = None
+        self.stopping = False
 
-        # 主布局（无修改）
-        main_layout = BoxLayout(orientation="horizontal", spacing=5, padding=5)
+        # 主布局：后台数据加载完成前禁用，on_app_data_loaded中启用
+        self.main_layout = main_layout = BoxLayout(orientation="horizontal", spacing=5, padding=5, disabled=True)
 
         # 左侧：会话列表
         self.session_list_layout = BoxLayout(orientation="vertical", size_hint=(0.3, 1))
         session_title = Label(text="会话列表", size_hint=(1, 0.05), font_size=16, bold=True)
         self.session_list_layout.add_widget(session_title)
-        self.session_scroll = ScrollView(size_hint=(1, 0.9))
-        self.session_grid = GridLayout(cols=1, spacing=5, size_hint_y=None)
-        self.session_grid.bind(minimum_height=self.session_grid.setter('height'))
-        self.session_scroll.add_widget(self.session_grid)
+        # 全文搜索框：回车后在所有会话中检索
+        self.search_input = TextInput(hint_text="搜索全部消息...", size_hint=(1, 0.05), multiline=False)
+        self.search_input.bind(on_text_validate=self.search_messages)
+        self.session_list_layout.add_widget(self.search_input)
+        self.session_scroll = RecycleView(size_hint=(1, 0.8))
+        session_grid = RecycleBoxLayout(orientation="vertical", spacing=5, default_size=(None, 80),
+                                        default_size_hint=(1, None), size_hint_y=None)
+        session_grid.bind(minimum_height=session_grid.setter('height'))
+        self.session_scroll.add_widget(session_grid)
+        # viewclass存在layout上，要在添加layout之后设置
+        self.session_scroll.viewclass = SessionRow
+        self.session_list = None
         self.session_list_layout.add_widget(self.session_scroll)
         new_session_btn = Button(text="+ 新建会话", size_hint=(1, 0.05), background_color=(0.2, 0.5, 0.9, 1))
         new_session_btn.bind(on_press=self.create_new_session)
         self.session_list_layout.add_widget(new_session_btn)
+        storage_btn = Button(text="存储占用", size_hint=(1, 0.05), background_color=(0.7, 0.7, 0.7, 1))
+        storage_btn.bind(on_press=self.show_storage_report)
+        self.session_list_layout.add_widget(storage_btn)
         main_layout.add_widget(self.session_list_layout)
 
         # 右侧：聊天界面
         self.chat_layout = BoxLayout(orientation="vertical", size_hint=(0.7, 1))
-        self.chat_title = Label(text=self.session_manager.get_current_session()["name"], 
-                                size_hint=(1, 0.05), font_size=16, bold=True)
-        self.chat_layout.add_widget(self.chat_title)
-        self.chat_scroll = ScrollView(size_hint=(1, 0.85))
-        self.chat_messages = GridLayout(cols=1, spacing=10, size_hint_y=None, padding=[10, 10, 10, 10])
-        self.chat_messages.bind(minimum_height=self.chat_messages.setter('height'))
-        self.chat_scroll.add_widget(self.chat_messages)
+        chat_header = BoxLayout(orientation="horizontal", size_hint=(1, 0.05))
+        self.chat_title = Label(text="加载中...", size_hint=(0.7, 1), font_size=16, bold=True)
+        # 回复缓存开关（按会话）：开启后相同上下文的提问直接回放本地结果
+        self.cache_toggle = ToggleButton(text="缓存", size_hint=(0.15, 1))
+        self.cache_toggle.bind(on_release=self.toggle_response_cache)
+        # 性能埋点开关：开启后记录到本地日志，并在标题下显示最近一次回复的耗时摘要
+        self.perf_toggle = ToggleButton(text="性能", size_hint=(0.15, 1))
+        self.perf_toggle.bind(on_release=self.toggle_perf)
+        chat_header.add_widget(self.chat_title)
+        chat_header.add_widget(self.cache_toggle)
+        chat_header.add_widget(self.perf_toggle)
+        self.chat_layout.add_widget(chat_header)
+        self.perf_overlay = Label(text="性能埋点已开启", size_hint=(1, 0.04), font_size=11,
+                                  color=(0.4, 0.4, 0.4, 1), shorten=True)
+        self.chat_scroll = ChatTranscript(size_hint=(1, 0.85))
+        self.chat_scroll.load_older = self.load_older_messages
+        self.chat_scroll.load_newer = self.load_newer_messages
+        self.oldest_msg_id = None
+        self.newest_msg_id = None
+        self.has_older_messages = False
+        self.has_newer_messages = False
         self.chat_layout.add_widget(self.chat_scroll)
         input_layout = BoxLayout(orientation="horizontal", size_hint=(1, 0.1), spacing=5)
-        self.msg_input = TextInput(hint_text="输入消息...", size_hint=(0.85, 1), multiline=True)
-        send_btn = Button(text="发送", size_hint=(0.15, 1), background_color=(0.2, 0.5, 0.9, 1))
+        self.msg_input = TextInput(hint_text="输入消息...", size_hint=(0.75, 1), multiline=True)
+        self.msg_input.bind(focus=self.on_input_focus)
+        send_btn = Button(text="发送", size_hint=(0.125, 1), background_color=(0.2, 0.5, 0.9, 1))
         send_btn.bind(on_press=self.send_message)
+        stop_btn = Button(text="停止", size_hint=(0.125, 1), background_color=(0.9, 0.3, 0.3, 1))
+        stop_btn.bind(on_press=self.stop_reply)
         input_layout.add_widget(self.msg_input)
         input_layout.add_widget(send_btn)
+        input_layout.add_widget(stop_btn)
         self.chat_layout.add_widget(input_layout)
         main_layout.add_widget(self.chat_layout)
 
+        STARTUP.mark("build")
+        Window.bind(on_flip=self.on_first_frame)
+        return main_layout
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        STARTUP.mark("first_frame")
+        threading.Thread(target=self.load_app_data, name="grok-startup", daemon=True).start()
+
+    # 后台线程：配置文件、会话索引（首次启动时含旧版迁移）、当前会话最近一页；会话库连接允许跨线程使用
+    def load_app_data(self):
+        try:
+            init_default_data(self)
+            config = {"api_key": get_api_key(), "api_url": get_api_url(), "perf_enabled": get_perf_enabled()}
+            STARTUP.mark("config")
+            session_manager = SessionManager(SESSIONS_DB, SESSIONS_FILE)
+            STARTUP.mark("session_index")
+            page = session_manager.get_message_page(session_manager.current_session_id, limit=MESSAGE_PAGE_SIZE)
+        except Exception as e:
+            Logger.exception("GrokChat: 启动加载失败")
+            self.on_load_failed(f"{type(e).__name__}: {e}")
+            return
+        self.on_app_data_loaded(session_manager, config, page)
+
+    @mainthread
+    def on_load_failed(self, message):
+        self.chat_title.text = "加载失败"
+        Popup(title="启动失败", content=Label(text=message), size_hint=(0.8, 0.4)).open()
+
+    @mainthread
+    def on_app_data_loaded(self, session_manager, config, page):
+        if self.stopping:
+            return
+        self.session_manager = session_manager
+        self.api_key = config["api_key"]
+        self.api_url = config["api_url"]  # 新增：读取自定义API地址
+        self.response_cache = ResponseCache(RESPONSE_CACHE_DB)
+        self.perf = PerfRecorder(PERF_LOG, config["perf_enabled"])
+        if self.perf.enabled:
+            self.perf_toggle.state = "down"
+            self.chat_layout.add_widget(self.perf_overlay, index=len(self.chat_layout.children) - 1)
+        self.session_list = SessionListModel(self.session_scroll, self.session_manager)
+        self.session_list.progress = self.replies.progress
+
         self.load_session_list()
-        self.load_chat_messages()
+        self.load_chat_messages(page=page)
+        STARTUP.mark("transcript")
+        self.chat_title.text = self.session_manager.get_current_session_meta()["name"]
+        self.update_cache_toggle()
+        self.main_layout.disabled = False
+        # 检查API密钥，无则弹出输入框
+        if not self.api_key:
+            self.show_api_key_popup()
+        # 继续投递上次未完成的消息
+        Clock.schedule_once(self.process_outbox, 0)
+        Clock.schedule_once(self.archive_cold_sessions, ARCHIVE_START_DELAY)
 
-        return main_layout
+        STARTUP.mark("interactive")
+        Logger.info(f"GrokChat: 启动耗时 {STARTUP.summary()}")
+        self.perf.write(STARTUP.record())
 
     # ========== 优化1：修改API密钥弹窗（新增自定义API地址） ==========
     def show_api_key_popup(self):
@@ -322,44 +845,24 @@ class GrokChatApp(App):
         self.api_key = api_key
         self.api_url = api_url
         self.api_popup.dismiss()
+        self.process_outbox()
 
-    # 会话管理相关函数（无修改）
+    # 会话管理相关函数（列表只做增量更新）
     def load_session_list(self):
-        self.session_grid.clear_widgets()
-        for session in self.session_manager.sessions:
-            session_item = BoxLayout(orientation="vertical", size_hint_y=None, height=80, padding=5)
-            session_name = Label(text=session["name"], font_size=14, bold=True, size_hint=(1, 0.5))
-            preview = Label(text=f"{session['last_msg']} | {session['timestamp']}", 
-                            font_size=12, color=(0.6, 0.6, 0.6, 1), size_hint=(1, 0.3))
-            btn_layout = BoxLayout(orientation="horizontal", size_hint=(1, 0.2), spacing=5)
-            rename_btn = Button(text="重命名", size_hint=(0.5, 1), font_size=10, background_color=(0.7, 0.7, 0.7, 1))
-            rename_btn.bind(on_press=lambda x, s=session["id"]: self.rename_session(s))
-            delete_btn = Button(text="删除", size_hint=(0.5, 1), font_size=10, background_color=(0.9, 0.3, 0.3, 1))
-            delete_btn.bind(on_press=lambda x, s=session["id"]: self.delete_session(s))
-            btn_layout.add_widget(rename_btn)
-            btn_layout.add_widget(delete_btn)
-
-            session_item.add_widget(session_name)
-            session_item.add_widget(preview)
-            session_item.add_widget(btn_layout)
-            session_item.bind(on_touch_down=lambda x, y, s=session["id"]: self.switch_session(s) if x.collide_point(*y.pos) else None)
-            if session["id"] == self.session_manager.current_session_id:
-                with session_item.canvas.before:
-                    Color(0.9, 0.9, 0.9, 1)
-                    RoundedRectangle(size=session_item.size, pos=session_item.pos, radius=[5])
-            self.session_grid.add_widget(session_item)
+        self.session_list.reset()
 
     def create_new_session(self, instance):
         session_id = self.session_manager.create_session()
-        self.switch_session(session_id)
-        self.load_session_list()
+        self.session_list.add(session_id)
+        self.session_list.select(session_id)
         self.clear_chat_messages()
-        self.chat_title.text = self.session_manager.get_current_session()["name"]
+        self.chat_title.text = self.session_manager.get_session_meta(session_id)["name"]
+        self.update_cache_toggle()
 
     def rename_session(self, session_id):
         popup_layout = BoxLayout(orientation="vertical", spacing=10, padding=20)
         popup_layout.add_widget(Label(text="输入新的会话名称"))
-        rename_input = TextInput(multiline=False, text=self.session_manager.get_current_session()["name"])
+        rename_input = TextInput(multiline=False, text=self.session_manager.get_session_meta(session_id)["name"])
         popup_layout.add_widget(rename_input)
         confirm_btn = Button(text="确认")
         confirm_btn.bind(on_press=lambda x: self.confirm_rename(session_id, rename_input.text))
@@ -374,7 +877,7 @@ class GrokChatApp(App):
             return
         self.session_manager.rename_session(session_id, new_name.strip())
         self.rename_popup.dismiss()
-        self.load_session_list()
+        self.session_list.update(session_id)
         if session_id == self.session_manager.current_session_id:
             self.chat_title.text = new_name.strip()
 
@@ -384,36 +887,407 @@ class GrokChatApp(App):
             popup = Popup(title="提示", content=Label(text="默认会话不能删除！"), size_hint=(0.6, 0.3))
             popup.open()
             return
-        self.load_session_list()
+        # 队列记录已随会话删除，取消仍在进行的请求
+        delivery = self.replies.for_session(session_id)
+        if delivery is not None:
+            self.network.cancel(delivery["future"])
+        self.session_list.remove(session_id)
+        self.session_list.select(self.session_manager.current_session_id)
         self.load_chat_messages()
-        self.chat_title.text = self.session_manager.get_current_session()["name"]
+        self.chat_title.text = self.session_manager.get_current_session_meta()["name"]
+        self.update_cache_toggle()
 
-    def switch_session(self, session_id):
-        self.session_manager.current_session_id = session_id
-        self.session_manager.save_sessions()
-        self.load_session_list()
+    def switch_session(self, session_id, around_msg_id=None):
+        # 切走后回复继续在后台生成，完成后写回所属会话
+        self.session_manager.set_current_session(session_id)
+        self.session_list.select(session_id)
+        self.load_chat_messages(around_msg_id)
+        self.chat_title.text = self.session_manager.get_session_meta(session_id)["name"]
+        self.update_cache_toggle()
+
+    # ========== 优化10：回复缓存开关 ==========
+    def update_cache_toggle(self):
+        enabled = self.session_manager.get_current_session_meta()["cache_enabled"]
+        self.cache_toggle.state = "down" if enabled else "normal"
+
+    def toggle_response_cache(self, instance):
+        self.session_manager.set_cache_enabled(self.session_manager.current_session_id, instance.state == "down")
+
+    # ========== 优化11：性能埋点 ==========
+    def toggle_perf(self, instance):
+        enabled = instance.state == "down"
+        save_perf_enabled(enabled)
+        self.perf.set_enabled(enabled)
+        if enabled and self.perf_overlay.parent is None:
+            # 插在标题栏下方
+            self.chat_layout.add_widget(self.perf_overlay, index=len(self.chat_layout.children) - 1)
+        elif not enabled and self.perf_overlay.parent is not None:
+            self.chat_layout.remove_widget(self.perf_overlay)
+            self.stop_frame_sampling()
+
+    # 流式期间每帧采样一次帧耗时，没有进行中的回复时停止
+    def start_frame_sampling(self):
+        if self.perf.enabled and self.frame_event is None:
+            self.frame_event = Clock.schedule_interval(self.perf.record_frame, 0)
+
+    def stop_frame_sampling(self):
+        if self.frame_event is not None:
+            self.frame_event.cancel()
+            self.frame_event = None
+
+    # ========== 优化13：多会话并发回复，会话列表定时刷新各会话的生成进度 ==========
+    def start_progress_refresh(self):
+        if self.progress_event is None:
+            self.progress_event = Clock.schedule_interval(self.refresh_reply_progress, REPLY_PROGRESS_INTERVAL)
+
+    def stop_progress_refresh(self):
+        if self.progress_event is not None:
+            self.progress_event.cancel()
+            self.progress_event = None
+
+    def refresh_reply_progress(self, dt):
+        # 内容没变的行不会被替换
+        for session_id in self.replies.busy_sessions():
+            self.session_list.update(session_id)
+
+    # 打开的会话正在后台生成回复时，把已收到的部分接到聊天记录末尾，继续流式显示
+    def attach_live_reply(self):
+        delivery = self.replies.for_session(self.session_manager.current_session_id)
+        if delivery is None or delivery["renderer"].attached():
+            return
+        row = delivery["renderer"].attach(datetime.datetime.now().strftime("%H:%M"))
+        self.reply_rows[delivery["entry"]["id"]] = row
+
+    # 排队中的提问还只在outbox中，接在正在生成的回复之后显示，各带一个占位气泡
+    def attach_queued_messages(self):
+        for entry in self.session_manager.queued_messages(self.session_manager.current_session_id):
+            self.add_message_bubble(entry["content"], "user", entry["time"])
+            self.reply_rows[entry["id"]] = self.add_message_bubble("排队中…", "grok", entry["time"])
+
+    def finish_trace(self, trace, status, error=None):
+        record = trace.end(status=status, error=error)
+        if record is not None and self.perf_overlay.parent is not None:
+            self.perf_overlay.text = format_summary(record)
+
+    # ========== 优化12：冷会话归档（后台线程使用独立连接逐个压缩，主线程只同步会话列表） ==========
+    def archive_cold_sessions(self, *args):
+        if self.stopping:
+            return
+        cutoff = cold_cutoff(ARCHIVE_AFTER_DAYS)
+        exclude = self.replies.busy_sessions() | {self.session_manager.current_session_id}
+
+        def work():
+            store = None
+            archived = []
+            try:
+                store = SessionStore(SESSIONS_DB)
+                archived = store.archive_cold(cutoff, exclude, should_stop=lambda: self.stopping,
+                                              on_archived=self.on_session_archived)
+            except Exception:
+                Logger.exception("GrokChat: 冷会话归档失败")
+            finally:
+                if store is not None:
+                    store.close()
+            if archived:
+                Logger.info(f"GrokChat: 已归档{len(archived)}个超过{ARCHIVE_AFTER_DAYS}天未打开的会话")
+
+        threading.Thread(target=work, name="grok-archive", daemon=True).start()
+
+    @mainthread
+    def on_session_archived(self, session_id):
+        self.session_manager.mark_archived(session_id)
+        self.session_list.update(session_id)
+
+    def show_storage_report(self, instance):
+        report = self.session_manager.storage_report()
+        ratio = report["archived_bytes"] / report["archived_raw_bytes"] if report["archived_raw_bytes"] else 0
+        lines = [
+            f"会话数据库：{format_bytes(report['file_bytes'])}（可回收 {format_bytes(report['free_bytes'])}）",
+            f"活跃会话：{report['hot_sessions']}个，{report['hot_messages']}条消息，"
+            f"正文 {format_bytes(report['hot_text_bytes'])}",
+            f"已归档会话：{report['archived_sessions']}个，{report['archived_messages']}条消息，"
+            f"{format_bytes(report['archived_raw_bytes'])} 压缩为 {format_bytes(report['archived_bytes'])}"
+            f"（{ratio:.0%}）",
+            f"回复缓存：{format_bytes(file_size(RESPONSE_CACHE_DB))}",
+            f"性能日志：{format_bytes(file_size(PERF_LOG))}"
+        ]
+        popup_layout = BoxLayout(orientation="vertical", spacing=10, padding=20)
+        popup_layout.add_widget(Label(text="\n".join(lines), halign="left", valign="top"))
+        transfer_layout = BoxLayout(orientation="horizontal", size_hint=(1, 0.25), spacing=10)
+        export_btn = Button(text="导出备份")
+        import_btn = Button(text="导入备份")
+        transfer_layout.add_widget(export_btn)
+        transfer_layout.add_widget(import_btn)
+        popup_layout.add_widget(transfer_layout)
+        btn_layout = BoxLayout(orientation="horizontal", size_hint=(1, 0.25), spacing=10)
+        vacuum_btn = Button(text="整理数据库")
+        close_btn = Button(text="关闭")
+        btn_layout.add_widget(vacuum_btn)
+        btn_layout.add_widget(close_btn)
+        popup_layout.add_widget(btn_layout)
+        popup = Popup(title="存储占用", content=popup_layout, size_hint=(0.9, 0.7))
+        export_btn.bind(on_press=lambda x: self.export_sessions(popup))
+        import_btn.bind(on_press=lambda x: self.choose_import_file(popup))
+        vacuum_btn.bind(on_press=lambda x: self.vacuum_storage(popup))
+        close_btn.bind(on_press=popup.dismiss)
+        popup.open()
+
+    # 归档后空出的空间要整理后才会还给系统；VACUUM会重写整个数据库，在后台线程用独立连接进行
+    def vacuum_storage(self, popup):
+        popup.dismiss()
+        label = Label(text="正在整理数据库...")
+        progress = Popup(title="整理数据库", content=label, size_hint=(0.8, 0.35), auto_dismiss=False)
+        progress.open()
+
+        def work():
+            # 后台归档正在写入时会报database is locked，失败原因显示在弹窗中
+            store = None
+            message = None
+            try:
+                store = SessionStore(SESSIONS_DB)
+                store.vacuum()
+            except Exception as e:
+                Logger.exception("GrokChat: 整理数据库失败")
+                message = f"整理数据库失败：{e}"
+            finally:
+                if store is not None:
+                    store.close()
+            self.on_vacuum_done(progress, label, message)
+
+        threading.Thread(target=work, name="grok-vacuum", daemon=True).start()
+
+    @mainthread
+    def on_vacuum_done(self, popup, label, message):
+        if message is not None:
+            label.text = message
+            popup.auto_dismiss = True
+            return
+        popup.dismiss()
+        self.show_storage_report(None)
+
+    # ========== 优化16：会话档案导出/导入（后台线程 + 独立数据库连接，流式读写，弹窗显示进度） ==========
+    # 备份不能放在DATA_DIR（Android上是应用私有目录，用户拿不到，卸载即删除）
+    def export_sessions(self, popup):
+        popup.dismiss()
+        name = f"grokchat-{datetime.datetime.now():%Y%m%d-%H%M%S}.gcx"
+        # plyer按平台加载实现，首次使用时再导入
+        if platform == "android":
+            # plyer在Android上只有打开文件的对话框：写到公共下载目录，卸载后仍保留，可直接拷到其它设备
+            from plyer import storagepath
+            from jnius import autoclass
+            path = os.path.join(storagepath.get_downloads_dir(), name)
+            # Android 11起可按路径写自己创建的公共目录文件，不需要权限（清单中的存储权限也只声明到API 29）
+            if autoclass("android.os.Build$VERSION").SDK_INT > 29:
+                self.on_export_selected([path])
+                return
+            # Android 10及以下需要存储权限；Android 10另靠清单中的requestLegacyExternalStorage关闭分区存储
+            from android.permissions import request_permissions, Permission
+            request_permissions([Permission.WRITE_EXTERNAL_STORAGE],
+                                lambda permissions, grants: self.on_export_permission(path, grants))
+            return
+        from plyer import filechooser
+        filechooser.save_file(on_selection=self.on_export_selected, path=os.path.join(os.path.expanduser("~"), name),
+                              filters=[["GrokChat备份", "*.gcx", "*.jsonl"]])
+
+    @mainthread
+    def on_export_permission(self, path, grants):
+        if not all(grants):
+            popup = Popup(title="导出备份", content=Label(text="没有存储权限，无法写入下载目录"), size_hint=(0.6, 0.3))
+            popup.open()
+            return
+        self.on_export_selected([path])
+
+    @mainthread
+    def on_export_selected(self, selection):
+        if not selection:
+            return
+        path = selection[0]
+        self.run_transfer("导出备份", lambda store, progress: export_archive(store, path, progress=progress),
+                          lambda counts: f"已导出 {counts['sessions']}个会话，{counts['messages']}条消息\n{path}")
+
+    def choose_import_file(self, popup):
+        popup.dismiss()
+        # plyer按平台加载实现，首次使用时再导入
+        from plyer import filechooser
+        filechooser.open_file(on_selection=self.on_import_selected,
+                              filters=[["GrokChat备份", "*.gcx", "*.jsonl"]])
+
+    @mainthread
+    def on_import_selected(self, selection):
+        if not selection:
+            return
+        path = selection[0]
+        self.run_transfer("导入备份", lambda store, progress: import_archive(store, path, progress),
+                          lambda counts: f"新增 {counts['messages']}条消息（新会话 {counts['sessions']}个，"
+                                         f"合并 {counts['merged_sessions']}个，跳过重复 {counts['duplicates']}条）"
+                                         + ("" if counts["complete"] else "\n档案缺少结束记录，可能不完整"),
+                          reload=True)
+
+    def run_transfer(self, title, job, describe, reload=False):
+        label = Label(text="准备中...")
+        popup = Popup(title=title, content=label, size_hint=(0.8, 0.35), auto_dismiss=False)
+        popup.open()
+
+        def progress(done, total, counts):
+            self.set_label_text(label, f"{done / total if total else 1:.0%}  会话 {counts['sessions']}  "
+                                       f"消息 {counts['messages']}")
+
+        def work():
+            # 无论成功与否都要回到主线程收尾，否则不可关闭的进度弹窗会一直留在屏幕上
+            store = None
+            try:
+                store = SessionStore(SESSIONS_DB)
+                message = describe(job(store, progress))
+            except TransferError as e:
+                message = f"{title}失败：{e}"
+            except Exception as e:
+                Logger.exception(f"GrokChat: {title}失败")
+                message = f"{title}失败：{e}"
+            finally:
+                if store is not None:
+                    store.close()
+            self.on_transfer_done(popup, label, message, reload)
+
+        threading.Thread(target=work, name="grok-transfer", daemon=True).start()
+
+    @mainthread
+    def set_label_text(self, label, text):
+        label.text = text
+
+    @mainthread
+    def on_transfer_done(self, popup, label, message, reload):
+        label.text = message
+        popup.auto_dismiss = True
+        if not reload:
+            return
+        # 导入可能新增会话或消息，重新读取会话列表和当前会话
+        self.session_manager.load_sessions()
+        self.session_list.reset()
         self.load_chat_messages()
-        self.chat_title.text = self.session_manager.get_current_session()["name"]
 
-    def load_chat_messages(self):
-        self.clear_chat_messages()
-        current_session = self.session_manager.get_current_session()
-        for msg in current_session["messages"]:
-            self.add_message_bubble(msg["content"], msg["role"], msg["time"])
-        self.chat_scroll.scroll_y = 0
+    # ========== 优化8：全文搜索，点击结果只加载目标消息附近一页 ==========
+    def search_messages(self, instance):
+        query = self.search_input.text.strip()
+        if not query:
+            return
+        results = self.session_manager.search(query)
+        if not results:
+            popup = Popup(title="搜索", content=Label(text="没有找到相关消息"), size_hint=(0.6, 0.3))
+            popup.open()
+            return
+        result_view = RecycleView()
+        result_layout = RecycleBoxLayout(orientation="vertical", spacing=4, default_size=(None, 56),
+                                         default_size_hint=(1, None), size_hint_y=None)
+        result_layout.bind(minimum_height=result_layout.setter('height'))
+        result_view.add_widget(result_layout)
+        result_view.viewclass = SearchResultRow
+        result_view.data = [{
+            "text": f"[{r['session_name']}] {'我' if r['role'] == 'user' else 'Grok'}：{r['snippet']}",
+            "result": r
+        } for r in results]
+        self.search_popup = Popup(title=f"搜索结果（{len(results)}）", content=result_view, size_hint=(0.9, 0.8))
+        self.search_popup.open()
+
+    def open_search_result(self, result):
+        self.search_popup.dismiss()
+        self.switch_session(result["session_id"], around_msg_id=result["message_id"])
+
+    # ========== 优化4：打开会话只读取最近一页，耗时与会话长度无关 ==========
+    # page：启动时后台线程预取的最近一页
+    def load_chat_messages(self, around_msg_id=None, page=None):
+        session_id = self.session_manager.current_session_id
+        if around_msg_id is None:
+            if page is None:
+                page = self.session_manager.get_message_page(session_id, limit=MESSAGE_PAGE_SIZE)
+            self.has_older_messages = len(page) == MESSAGE_PAGE_SIZE
+            self.has_newer_messages = False
+        else:
+            page = self.session_manager.get_message_window(session_id, around_msg_id, limit=MESSAGE_PAGE_SIZE)
+            # 窗口两侧是否还有消息，交给滚动到边缘时的分页加载去判断
+            self.has_older_messages = True
+            self.has_newer_messages = True
+        self.chat_scroll.data = [self.chat_scroll.make_row(msg["content"], msg["role"], msg["time"], msg["id"])
+                                 for msg in page]
+        self.oldest_msg_id = page[0]["id"] if page else None
+        self.newest_msg_id = page[-1]["id"] if page else None
+        if not self.has_newer_messages:
+            self.attach_live_reply()
+            self.attach_queued_messages()
+        if around_msg_id is None:
+            self.chat_scroll.scroll_to_newest()
+        else:
+            index = next((i for i, msg in enumerate(page) if msg["id"] == around_msg_id), 0)
+            self.chat_scroll.scroll_to_row(index)
+
+    def load_newer_messages(self):
+        if not self.has_newer_messages or self.newest_msg_id is None:
+            return
+        page = self.session_manager.get_messages_after(self.session_manager.current_session_id,
+                                                       self.newest_msg_id, limit=MESSAGE_PAGE_SIZE)
+        if page:
+            rows = [self.chat_scroll.make_row(msg["content"], msg["role"], msg["time"], msg["id"]) for msg in page]
+            self.chat_scroll.data.extend(rows)
+            self.newest_msg_id = page[-1]["id"]
+        self.has_newer_messages = len(page) == MESSAGE_PAGE_SIZE
+        if not self.has_newer_messages:
+            self.attach_live_reply()
+            self.attach_queued_messages()
+
+    def load_older_messages(self):
+        if not self.has_older_messages or self.oldest_msg_id is None:
+            return 0
+        page = self.session_manager.get_message_page(self.session_manager.current_session_id,
+                                                     before_id=self.oldest_msg_id, limit=MESSAGE_PAGE_SIZE)
+        if not page:
+            self.has_older_messages = False
+            return 0
+        rows = [self.chat_scroll.make_row(msg["content"], msg["role"], msg["time"], msg["id"]) for msg in page]
+        self.chat_scroll.data = rows + list(self.chat_scroll.data)
+        self.oldest_msg_id = page[0]["id"]
+        self.has_older_messages = len(page) == MESSAGE_PAGE_SIZE
+        return sum(row["height"] for row in rows) + self.chat_scroll.layout.spacing * len(rows)
 
     def clear_chat_messages(self):
-        self.chat_messages.clear_widgets()
+        self.chat_scroll.data = []
+        self.oldest_msg_id = None
+        self.newest_msg_id = None
+        self.has_older_messages = False
+        self.has_newer_messages = False
 
     def add_message_bubble(self, content, role, time):
-        bubble = MessageBubble(content, role, time, size_hint_x=None, width=WINDOW_WIDTH*0.5)
-        if role == "user":
-            bubble.halign = "right"
-            bubble.pos_hint = {"right": 1}
-        else:
-            bubble.halign = "left"
-            bubble.pos_hint = {"left": 0}
-        self.chat_messages.add_widget(bubble)
+        return self.chat_scroll.append_row(content, role, time)
+
+    # 输入框获得焦点时预热连接，发送时省去握手耗时
+    def on_input_focus(self, instance, focused):
+        if focused and self.api_key and self.api_url:
+            self.network.submit(self.chat_client.prewarm(self.api_url), bounded=False)
+
+    def on_stop(self):
+        # 退出时未完成的消息留在队列中，下次启动继续投递
+        self.stopping = True
+        self.network.stop(self.chat_client)
+        if self.session_manager is None:
+            return  # 后台加载尚未完成
+        self.perf.close()
+        stats = self.response_cache.stats()
+        Logger.info(f"GrokChat: 回复缓存命中 {stats['hits']}/{stats['hits'] + stats['misses']}，"
+                    f"{stats['entries']}条，{stats['bytes'] / 1024:.0f}KB")
+        self.response_cache.close()
+
+    # 停止当前会话：取消正在生成的回复（保留已收到部分），并放弃排队中和等待重试的消息
+    def stop_reply(self, *args):
+        session_id = self.session_manager.current_session_id
+        delivery = self.replies.for_session(session_id)
+        if delivery is not None:
+            self.network.cancel(delivery["future"])
+        for entry in self.session_manager.pending_outbox():
+            if entry["session_id"] != session_id or entry["id"] in self.replies:
+                continue
+            # 排队中的提问还没写入会话；等待重试的已写入，与没有收到回复的取消投递相同，由drop_outbox连同提问一起撤回
+            self.session_manager.drop_outbox(entry)
+            row = self.reply_rows.pop(entry["id"], None)
+            if row is not None:
+                self.chat_scroll.set_row_content(row, "已停止" if entry["message_id"] else "已停止发送")
 
     def send_message(self, instance):
         user_msg = self.msg_input.text.strip()
@@ -425,95 +1299,178 @@ class GrokChatApp(App):
 
         self.msg_input.text = ""
 
-        current_session = self.session_manager.get_current_session()
-        if len(current_session["messages"]) == 0 and current_session["id"] != "default":
-            self.session_manager.rename_session(current_session["id"], user_msg[:20])
+        current_session_id = self.session_manager.current_session_id
+        if not self.session_manager.has_messages(current_session_id) and current_session_id != "default":
+            self.session_manager.rename_session(current_session_id, user_msg[:20])
             self.chat_title.text = user_msg[:20]
-            self.load_session_list()
 
-        current_time = datetime.datetime.now().strftime("%H:%M")
+        # 从搜索结果跳入、尚未加载到最新消息时，先回到最新一页
+        if self.has_newer_messages:
+            self.load_chat_messages()
+
+        # 提问先写入待发送队列，再显示；投递开始时才写入会话
+        trace = self.perf.trace("reply", session_id=current_session_id)
+        with trace.span("enqueue"):
+            entry = self.session_manager.enqueue_message(current_session_id, user_msg)
+        if trace.enabled:
+            self.traces[entry["id"]] = trace
+        current_time = entry["time"]
         self.add_message_bubble(user_msg, "user", current_time)
-        self.chat_scroll.scroll_y = 0
+        self.chat_scroll.scroll_to_newest()
+        self.process_outbox()
+        if entry["id"] not in self.replies:
+            # 前一条还在生成或已达到并发上限，先占位
+            self.reply_rows[entry["id"]] = self.add_message_bubble("排队中…", "grok", current_time)
+        self.session_list.update(current_session_id)
 
-        asyncio.run_coroutine_threadsafe(self.get_grok_response(user_msg), asyncio.get_event_loop())
+    # ========== 优化9：待发送队列调度（主线程），同一会话按顺序投递 ==========
+    def process_outbox(self, *args):
+        if self.outbox_event is not None:
+            self.outbox_event.cancel()
+            self.outbox_event = None
+        if not self.api_key or self.stopping:
+            return
+        now = time.time()
+        busy_sessions = self.replies.busy_sessions()
+        queued = set()
+        next_wake = None
+        for entry in self.session_manager.pending_outbox():
+            if entry["session_id"] in busy_sessions:
+                continue
+            # 同一会话的后续消息要等前一条完成
+            busy_sessions.add(entry["session_id"])
+            if entry["next_attempt"] > now:
+                next_wake = entry["next_attempt"] if next_wake is None else min(next_wake, entry["next_attempt"])
+                continue
+            # 达到全局并发上限：按队列顺序等待，有回复完成时再调度
+            if self.replies.full():
+                queued.add(entry["session_id"])
+                continue
+            if not self.start_delivery(entry):
+                # 网络线程队列已满，稍后再试
+                queued.add(entry["session_id"])
+                next_wake = now + 1
+                break
+        # 进入或离开排队状态的会话刷新列表显示
+        changed = queued ^ self.replies.queued
+        self.replies.queued = queued
+        for session_id in changed:
+            self.session_list.update(session_id)
+        if next_wake is not None:
+            self.outbox_event = Clock.schedule_once(self.process_outbox, max(0, next_wake - now))
 
-    # ========== 优化2：流式请求（分类异常处理） ==========
-    async def get_grok_response(self, user_msg):
-        current_session = self.session_manager.get_current_session()
-        # 使用自定义API地址
-        grok_api_url = self.api_url
+    def start_delivery(self, entry):
+        # 界面相关的准备都在主线程完成，网络线程只负责请求和推送token
+        row = None
+        if entry["session_id"] == self.session_manager.current_session_id:
+            row = self.reply_rows.get(entry["id"])
+            if row is None or self.chat_scroll.find_row(row) < 0:
+                row = self.add_message_bubble("", "grok", datetime.datetime.now().strftime("%H:%M"))
+            else:
+                self.chat_scroll.set_row_content(row, "")
+            self.reply_rows[entry["id"]] = row
+        # 重试或启动后恢复的消息没有发送时的记录，从这里开始计时
+        trace = self.traces.pop(entry["id"], None) or self.perf.trace("reply", session_id=entry["session_id"])
+        renderer = StreamRenderer(self.chat_scroll, row, trace=trace)
+        # 同一会话的上一条回复已写回，此时提问才入库，上下文中包含上一条回复
+        self.session_manager.start_outbox(entry)
+        with trace.span("context"):
+            messages = self.session_manager.build_context(entry["session_id"], entry["content"], DEFAULT_MODEL,
+                                                          before_id=entry["message_id"])
+        cache_key = None
+        cached = None
+        if self.session_manager.get_session_meta(entry["session_id"])["cache_enabled"]:
+            cache_key = ResponseCache.make_key(self.api_url, DEFAULT_MODEL, messages)
+            cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            future = self.network.submit(self.replay_cached(cached, renderer))
+        else:
+            future = self.network.submit(self.get_grok_response(messages, renderer, trace))
+        if future is None:
+            if trace.enabled:
+                self.traces[entry["id"]] = trace
+            return False
+        self.replies.add({"entry": entry, "future": future, "renderer": renderer,
+                          "cache_key": cache_key, "cached": cached is not None, "trace": trace})
+        self.start_frame_sampling()
+        self.start_progress_refresh()
+        future.add_done_callback(lambda f, e=entry: self.on_delivery_done(e, f))
+        return True
 
-        messages = current_session["context"] + [{"role": "user", "content": user_msg}]
-        payload = {
-            "model": "grok-1",
-            "messages": messages,
-            "stream": True
-        }
+    # 投递结束（成功/失败/取消）回到主线程处理：写回会话或安排重试
+    @mainthread
+    def on_delivery_done(self, entry, future):
+        if self.stopping:
+            return
+        delivery = self.replies.pop(entry["id"])
+        if not self.replies:
+            self.stop_frame_sampling()
+            self.stop_progress_refresh()
+        session_id = entry["session_id"]
+        if delivery is None or session_id not in self.session_manager.session_index:
+            self.process_outbox()
+            return  # 会话已被删除
+        renderer = delivery["renderer"]
+        trace = delivery["trace"]
 
-        grok_bubble = MessageBubble("", "grok", datetime.datetime.now().strftime("%H:%M"), 
-                                    size_hint_x=None, width=WINDOW_WIDTH*0.5)
-        grok_bubble.halign = "left"
-        grok_bubble.pos_hint = {"left": 0}
-        self.chat_messages.add_widget(grok_bubble)
+        if future.cancelled():
+            partial = renderer.finish()
+            with trace.span("save"):
+                if partial:
+                    self.session_manager.complete_outbox(entry, partial)
+                else:
+                    self.session_manager.drop_outbox(entry)
+            if not partial:
+                renderer.fail("已停止")
+            self.reply_rows.pop(entry["id"], None)
+            self.finish_trace(trace, "cancelled")
+        elif future.exception() is None:
+            reply = future.result()
+            with trace.span("save"):
+                self.session_manager.complete_outbox(entry, reply)
+            self.finish_trace(trace, "cached" if delivery["cached"] else "ok")
+            if delivery["cache_key"] is not None and not delivery["cached"] and reply:
+                self.response_cache.put(delivery["cache_key"], reply)
+                stats = self.response_cache.stats()
+                Logger.info(f"GrokChat: 回复缓存命中率 {stats['hit_rate']:.0%}（{stats['entries']}条）")
+            self.reply_rows.pop(entry["id"], None)
+            # 生成期间用户切走又切回，气泡行已不在界面上，补显示完整回复
+            if session_id == self.session_manager.current_session_id and not renderer.attached():
+                self.add_message_bubble(reply, "grok", datetime.datetime.now().strftime("%H:%M"))
+                self.chat_scroll.scroll_to_newest()
+        else:
+            error = classify_error(future.exception())
+            self.finish_trace(trace, "error", error.message)
+            if error.retryable:
+                delay = retry_delay(entry["attempts"], error.retry_after)
+                self.session_manager.reschedule_outbox(entry, delay, error.message)
+                renderer.fail(f"{error.message}\n{delay:.0f}秒后自动重试（第{entry['attempts']}次）")
+            else:
+                self.session_manager.drop_outbox(entry)
+                self.reply_rows.pop(entry["id"], None)
+                renderer.fail(error.message)
+        self.session_list.update(session_id)
+        self.process_outbox()
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    grok_api_url,
-                    headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=30)  # 新增超时设置
-                ) as response:
-                    # 状态码异常处理
-                    if response.status == 401:
-                        self.update_bubble_text(grok_bubble, "API密钥无效或无访问权限（需X Premium+）")
-                        return
-                    elif response.status == 403:
-                        self.update_bubble_text(grok_bubble, "当前地区不支持访问该API")
-                        return
-                    elif response.status == 429:
-                        self.update_bubble_text(grok_bubble, "请求过于频繁，请稍后重试")
-                        return
-                    elif response.status != 200:
-                        self.update_bubble_text(grok_bubble, f"请求失败：{response.status}（请检查API地址）")
-                        return
-
-                    # 流式读取响应
-                    full_response = ""
-                    async for line in response.content:
-                        if line:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith("data: "):
-                                data = line_text[6:]
-                                if data == "[DONE]":
-                                    break
-                                try:
-                                    json_data = json.loads(data)
-                                    delta = json_data["choices"][0]["delta"]
-                                    if "content" in delta:
-                                        full_response += delta["content"]
-                                        self.update_bubble_text(grok_bubble, full_response)
-                                        self.chat_scroll.scroll_y = 0
-                                except Exception as e:
-                                    continue
-
-            self.session_manager.update_session_msg(current_session["id"], user_msg, full_response)
-            self.load_session_list()
-
-        # ========== 优化2：分类异常提示 ==========
-        except aiohttp.ClientConnectorError:
-            self.update_bubble_text(grok_bubble, "无法连接服务器，请检查网络或API地址")
-        except asyncio.TimeoutError:
-            self.update_bubble_text(grok_bubble, "请求超时，请检查网络或稍后重试")
-        except aiohttp.ClientError as e:
-            self.update_bubble_text(grok_bubble, f"网络请求错误：{type(e).__name__}")
-        except Exception as e:
-            self.update_bubble_text(grok_bubble, f"未知错误：{type(e).__name__}（请检查API配置）")
+    # 缓存命中：分块推给渲染器，每块之间让出事件循环，界面按帧合并刷新
+    async def replay_cached(self, reply, renderer):
+        for start in range(0, len(reply), CACHE_REPLAY_CHUNK):
+            renderer.append(reply[start:start + CACHE_REPLAY_CHUNK])
+            await asyncio.sleep(0)
+        return renderer.finish()
 
-    @mainthread
-    def update_bubble_text(self, bubble, text):
-        bubble.text = f"{text}\n[size=10][color=#666666]{bubble.time}[/color][/size]"
-        bubble.content = text
+    # ========== 优化2：流式请求，在网络线程中运行；失败抛出异常由调度器分类处理 ==========
+    async def get_grok_response(self, messages, renderer, trace=NULL_TRACE):
+        # 请求流程在grok_client.stream_chat中（与界面无关，批量运行共用），这里只把文本交给渲染器
+        result = await stream_chat(self.chat_client, self.api_url, self.api_key, messages,
+                                   renderer.append, trace=trace)
+        if result["ttft_ms"] is not None:
+            Logger.info(f"GrokChat: 首token耗时 {result['ttft_ms']:.0f}ms"
+                        f"（平均 {self.chat_client.average_ttft_ms():.0f}ms）")
+        if result["sse_errors"]:
+            Logger.warning(f"GrokChat: 流式响应中有{result['sse_errors']}个事件无法解析"
+                           f"（最后一个：{result['last_error']}）")
+        return renderer.finish()
 
 if __name__ == "__main__":
     Window.softinput_mode = "below_target"
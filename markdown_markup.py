@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown -> Kivy markup（与界面无关）
+优化点：1. 正文中的 & [ ] 全部转义，模型输出的方括号不再被当成标签
+        2. 按块解析：标题、列表、引用、分隔线、代码块（围栏内原样显示，不解析行内格式）；行内代码、粗体、斜体、删除线、链接
+        3. 流式时增量切块：只扫描新到的行，已完成的块交给调用方固定下来，之后只重新解析末尾未完成的块
+"""
+import re
+
+CODE_FONT = "RobotoMono-Regular"  # Kivy自带的等宽字体
+HEADING_SIZES = {1: 20, 2: 18, 3: 16}  # 正文14，四级及以下标题用15
+RULE = "────────────"
+
+FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})")
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+QUOTE_RE = re.compile(r"^\s*>\s?(.*)$")
+BULLET_RE = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+ORDERED_RE = re.compile(r"^(\s*)(\d{1,9})[.)]\s+(.*)$")
+# 行内格式：依次为行内代码、链接、粗体、删除线、斜体；匹配到的内层文本递归处理
+INLINE_RE = re.compile(
+    r"(?P<code>`+)(?P<code_text>.+?)(?P=code)"
+    r"|\[(?P<link_text>[^\[\]]+)\]\((?P<url>[^()\s\[\]]+)\)"
+    r"|\*\*(?P<bold>\S(?:.*?\S)?)\*\*|__(?P<bold2>\S(?:.*?\S)?)__"
+    r"|~~(?P<strike>\S(?:.*?\S)?)~~"
+    r"|\*(?P<italic>[^\s*](?:.*?[^\s*])?)\*|(?<!\w)_(?P<italic2>[^\s_](?:.*?[^\s_])?)_(?!\w)"
+)
+
+
+def escape(text):
+    return text.replace("&", "&amp;").replace("[", "&bl;").replace("]", "&br;")
+
+
+def render_inline(text):
+    parts = []
+    pos = 0
+    for match in INLINE_RE.finditer(text):
+        parts.append(escape(text[pos:match.start()]))
+        pos = match.end()
+        group = match.lastgroup
+        if match.group("code") is not None:
+            parts.append(f"[font={CODE_FONT}]{escape(match.group('code_text'))}[/font]")
+        elif group == "url":
+            parts.append(f"[u]{render_inline(match.group('link_text'))}[/u]")
+        elif group in ("bold", "bold2"):
+            parts.append(f"[b]{render_inline(match.group(group))}[/b]")
+        elif group == "strike":
+            parts.append(f"[s]{render_inline(match.group(group))}[/s]")
+        else:
+            parts.append(f"[i]{render_inline(match.group(group))}[/i]")
+    parts.append(escape(text[pos:]))
+    return "".join(parts)
+
+
+def render_line(line):
+    match = HEADING_RE.match(line)
+    if match:
+        size = HEADING_SIZES.get(len(match.group(1)), 15)
+        return f"[size={size}][b]{render_inline(match.group(2))}[/b][/size]"
+    if RULE_RE.match(line):
+        return RULE
+    match = BULLET_RE.match(line)
+    if match:
+        return f"{'  ' * (len(match.group(1)) // 2)}• {render_inline(match.group(2))}"
+    match = ORDERED_RE.match(line)
+    if match:
+        return f"{'  ' * (len(match.group(1)) // 2)}{match.group(2)}. {render_inline(match.group(3))}"
+    match = QUOTE_RE.match(line)
+    if match:
+        return f"│ [i]{render_inline(match.group(1))}[/i]"
+    return render_inline(line)
+
+
+# 一个块 -> markup；流式中尚未闭合的代码块也按代码显示
+def render_block(block):
+    lines = block.strip("\n").split("\n")
+    fence = FENCE_RE.match(lines[0])
+    if fence:
+        marker = fence.group(1)
+        body = lines[1:]
+        if body and body[-1].strip().startswith(marker) and not body[-1].strip().strip(marker[0]):
+            body = body[:-1]
+        return f"[font={CODE_FONT}]{escape(chr(10).join(body))}[/font]"
+    return "\n".join(render_line(line) for line in lines)
+
+
+# ========== 增量切块：空行（代码块外）或闭合的代码围栏结束一个块 ==========
+class MarkdownStream:
+    def __init__(self):
+        self.tail = ""  # 尚未完成的块（可能含多行）
+        self.scanned = 0  # tail中已扫描过的完整行的长度
+        self.fence = None  # 正在进行的代码块的围栏标记
+
+    # 追加文本，返回这次新完成的块（原文）；每行只扫描一次
+    def feed(self, text):
+        self.tail += text
+        finished = []
+        tail = self.tail
+        start = self.scanned
+        while True:
+            end = tail.find("\n", start)
+            if end < 0:
+                break
+            line = tail[start:end]
+            if self.fence is not None:
+                stripped = line.strip()
+                if stripped.startswith(self.fence) and not stripped.strip(self.fence[0]):
+                    self.fence = None
+                    finished.append(tail[:end])
+                    tail = tail[end + 1:]
+                    start = 0
+                    continue
+            elif not line.strip():
+                if tail[:start].strip():
+                    finished.append(tail[:start].rstrip("\n"))
+                tail = tail[end + 1:]
+                start = 0
+                continue
+            else:
+                fence = FENCE_RE.match(line)
+                if fence:
+                    self.fence = fence.group(1)
+                    # 紧跟在段落后面的代码块：段落先结束，代码块单独成块
+                    if tail[:start].strip():
+                        finished.append(tail[:start].rstrip("\n"))
+                        tail = tail[start:]
+                        end -= start
+            start = end + 1
+        self.tail = tail
+        self.scanned = start
+        return finished
+
+
+def split_blocks(text):
+    stream = MarkdownStream()
+    blocks = stream.feed(text)
+    if stream.tail.strip():
+        blocks.append(stream.tail)
+    return blocks
+
+
+def render_markdown(text):
+    return "\n\n".join(render_block(block) for block in split_blocks(text))
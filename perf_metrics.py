@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能埋点（与界面无关）
+优化点：1. 每条回复一条记录：排队/组装上下文/DNS/建连/首字节/首token/解析/渲染/保存各阶段耗时
+        2. token速率、请求/响应字节数、流式期间的帧耗时直方图 3. 写入本地滚动JSONL日志
+        4. 关闭时返回空对象，调用方无需判断，开销接近零 5. 冷启动各阶段时间点（首帧、可交互）
+"""
+import json
+import time
+import logging
+import datetime
+from logging.handlers import RotatingFileHandler
+
+PERF_LOG_MAX_BYTES = 1024 * 1024  # 单个日志文件上限
+PERF_LOG_BACKUPS = 3  # 保留的历史日志文件数
+FRAME_BUCKETS_MS = (8, 16, 33, 50, 100, 250)  # 帧耗时直方图上界，最后一档为超过250ms
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+# 埋点关闭时使用的空记录
+class NullTrace:
+    enabled = False
+
+    def mark(self, name):
+        pass
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def span(self, name):
+        return NULL_SPAN
+
+    def end(self, **fields):
+        return None
+
+
+NULL_TRACE = NullTrace()
+
+
+class Span:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.started = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+# 一条回复的埋点：mark为距开始的时间点，add为累计耗时，count为计数；可跨线程写入不同字段
+class Trace:
+    enabled = True
+
+    def __init__(self, recorder, kind, fields):
+        self.recorder = recorder
+        self.kind = kind
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.marks = {}
+        self.durations = {}
+        self.counters = {}
+        self.frames_started = recorder.frames.snapshot()
+
+    def mark(self, name):
+        # 同名时间点只记第一次（如重定向后的第二次建连）
+        if name not in self.marks:
+            self.marks[name] = (time.perf_counter() - self.started) * 1000
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds * 1000
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def span(self, name):
+        return Span(self, name)
+
+    def end(self, **fields):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        record = {
+            "type": self.kind,
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            **self.fields,
+            **fields,
+            "total_ms": round(total_ms, 2),
+            "marks": {name: round(value, 2) for name, value in self.marks.items()},
+            "durations": {name: round(value, 2) for name, value in self.durations.items()},
+            "counters": self.counters,
+            "frames": self.recorder.frames.summary(self.frames_started)
+        }
+        tokens = self.counters.get("tokens", 0)
+        first_token = self.marks.get("first_token")
+        if tokens and first_token is not None:
+            stream_ms = self.marks.get("stream_end", total_ms) - first_token
+            record["tokens_per_sec"] = round(tokens / (stream_ms / 1000), 1) if stream_ms > 0 else None
+        self.recorder.write(record)
+        return record
+
+
+# 帧耗时直方图：累计计数，每条记录用开始时的快照求差，得到该回复期间的分布
+class FrameHistogram:
+    def __init__(self, buckets=FRAME_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def record(self, dt):
+        ms = dt * 1000
+        index = 0
+        while index < len(self.buckets) and ms > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+
+    def snapshot(self):
+        return list(self.counts)
+
+    def percentile(self, counts, ratio):
+        total = sum(counts)
+        if not total:
+            return None
+        threshold = total * ratio
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= threshold:
+                return self.buckets[index] if index < len(self.buckets) else None
+        return None
+
+    def summary(self, since=None):
+        counts = self.counts if since is None else [now - before for now, before in zip(self.counts, since)]
+        labels = [f"<={bound}ms" for bound in self.buckets] + [f">{self.buckets[-1]}ms"]
+        return {
+            "count": sum(counts),
+            "buckets": dict(zip(labels, counts)),
+            "p50_ms": self.percentile(counts, 0.5),
+            "p95_ms": self.percentile(counts, 0.95)
+        }
+
+
+class PerfRecorder:
+    def __init__(self, log_path, enabled=False, max_bytes=PERF_LOG_MAX_BYTES, backups=PERF_LOG_BACKUPS):
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = False
+        self.logger = None
+        self.frames = FrameHistogram()
+        self.last_record = None
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled):
+        # 首次开启时才打开日志文件
+        if enabled and self.logger is None:
+            handler = RotatingFileHandler(self.log_path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.Logger("grokchat.perf")
+            self.logger.addHandler(handler)
+        self.enabled = enabled
+
+    def trace(self, kind, **fields):
+        if not self.enabled:
+            return NULL_TRACE
+        return Trace(self, kind, fields)
+
+    def record_frame(self, dt):
+        if self.enabled:
+            self.frames.record(dt)
+
+    def write(self, record):
+        self.last_record = record
+        if self.logger is not None:
+            self.logger.info(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        if self.logger is not None:
+            for handler in self.logger.handlers:
+                handler.close()
+
+
+# 冷启动各阶段：以进程开始导入的时刻为零点，记录每个阶段完成的时间点（毫秒）；后台线程也可写入
+STARTUP_PHASES = (("imports", "导入"), ("build", "界面骨架"), ("first_frame", "首帧"), ("config", "配置"),
+                  ("session_index", "会话索引"), ("transcript", "当前会话"), ("interactive", "可交互"))
+
+
+class StartupProfile:
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks[name] = round((time.perf_counter() - self.started) * 1000, 2)
+        return self.marks[name]
+
+    def record(self):
+        return {
+            "type": "startup",
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "marks": dict(self.marks)
+        }
+
+    def summary(self):
+        return " · ".join(f"{label} {self.marks[name]:.0f}ms" for name, label in STARTUP_PHASES
+                          if name in self.marks)
+
+
+# 调试浮层上的一行摘要
+def format_summary(record):
+    marks = record["marks"]
+    durations = record["durations"]
+    parts = []
+    if "connect_end" in marks:
+        parts.append(f"建连 {marks['connect_end'] - marks.get('connect_start', 0):.0f}ms")
+    if "first_token" in marks:
+        parts.append(f"首token {marks['first_token']:.0f}ms")
+    if record.get("tokens_per_sec"):
+        parts.append(f"{record['tokens_per_sec']:.0f} tok/s")
+    for name, label in (("parse", "解析"), ("render", "渲染"), ("save", "保存")):
+        if name in durations:
+            parts.append(f"{label} {durations[name]:.0f}ms")
+    frames = record["frames"]
+    if frames["count"]:
+        parts.append(f"帧 p95 {frames['p95_ms'] or '>' + str(FRAME_BUCKETS_MS[-1])}ms")
+    parts.append(f"共 {record['total_ms']:.0f}ms")
+    return " · ".join(parts)
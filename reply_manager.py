@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多会话并发回复管理（与界面、网络库无关，只在主线程调用）
+优化点：1. 全局同时生成的回复数有上限，超出的按队列顺序等待 2. 每条回复绑定所属会话ID，同一会话按顺序生成
+        3. 按会话查询进度（已收到字数、排队中），供会话列表实时显示
+"""
+
+MAX_ACTIVE_REPLIES = 3  # 同时生成的回复上限（低于网络线程的请求上限，给预热等请求留余量）
+
+
+class ReplyManager:
+    def __init__(self, max_active=MAX_ACTIVE_REPLIES):
+        self.max_active = max_active
+        self.active = {}  # outbox_id -> 正在生成的回复（含entry、future、renderer等）
+        self.sessions = {}  # session_id -> outbox_id，每个会话同时只有一条
+        self.queued = set()  # 已到发送时间、因全局上限在等待的会话
+
+    def __len__(self):
+        return len(self.active)
+
+    def __contains__(self, entry_id):
+        return entry_id in self.active
+
+    def full(self):
+        return len(self.active) >= self.max_active
+
+    def busy_sessions(self):
+        return set(self.sessions)
+
+    def add(self, delivery):
+        entry = delivery["entry"]
+        self.active[entry["id"]] = delivery
+        self.sessions[entry["session_id"]] = entry["id"]
+        self.queued.discard(entry["session_id"])
+
+    def pop(self, entry_id):
+        delivery = self.active.pop(entry_id, None)
+        if delivery is not None:
+            self.sessions.pop(delivery["entry"]["session_id"], None)
+        return delivery
+
+    def for_session(self, session_id):
+        entry_id = self.sessions.get(session_id)
+        return None if entry_id is None else self.active[entry_id]
+
+    # 返回 ("streaming", 已收到字数) / ("queued", 0) / None
+    def progress(self, session_id):
+        delivery = self.for_session(session_id)
+        if delivery is not None:
+            return "streaming", delivery["renderer"].received
+        if session_id in self.queued:
+            return "queued", 0
+        return None
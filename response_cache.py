@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地回复缓存（SQLite，独立于会话库，可随时删除）
+优化点：1. 以 (api_url, model, 规范化后的messages) 的哈希为键 2. 总大小上限 + LRU淘汰 + TTL过期
+        3. 命中/未命中计数，便于评估缓存容量
+"""
+import json
+import sqlite3
+import hashlib
+import datetime
+
+RESPONSE_CACHE_MAX_BYTES = 20 * 1024 * 1024  # 缓存总大小上限
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);
+"""
+
+
+def now_epoch():
+    return datetime.datetime.now().timestamp()
+
+
+class ResponseCache:
+    def __init__(self, db_path, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    # 规范化：只保留role/content并去掉首尾空白，避免无关字段或空格差异导致未命中
+    @staticmethod
+    def make_key(api_url, model, messages):
+        normalized = [[m["role"], m["content"].strip()] for m in messages]
+        raw = json.dumps([api_url, model, normalized], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = now_epoch()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = now_epoch()
+        self.delete(key)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO responses (key, response, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now))
+        self.total_bytes += size
+        self.evict()
+
+    def delete(self, key):
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        with self.conn:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.total_bytes -= row[0]
+
+    def evict(self):
+        # 先清过期，再按最近使用时间淘汰到上限以内
+        cutoff = now_epoch() - self.ttl
+        with self.conn:
+            expired = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses WHERE created < ?", (cutoff,)).fetchone()[0]
+            if expired:
+                self.conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+                self.total_bytes -= expired
+            while self.total_bytes > self.max_bytes:
+                rows = self.conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used LIMIT 32").fetchall()
+                if not rows:
+                    self.total_bytes = 0
+                    break
+                for key, size in rows:
+                    if self.total_bytes <= self.max_bytes:
+                        break
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.total_bytes -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全文检索分词（配合SQLite FTS5 unicode61分词器使用）
+优化点：1. 中日韩文本切成重叠二元组，任意两字以上的词都能按短语命中
+        2. 单字查询用前缀匹配 3. 拉丁文本交给unicode61按词切分、忽略大小写
+"""
+import re
+
+# 与context_window.CJK_RE保持一致的中日韩字符范围
+CJK_RANGES = r"\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef"
+CJK_RUN_RE = re.compile(f"[{CJK_RANGES}]+")
+# 非中日韩分支排除中日韩字符（\w本身包含它们），“用Python写”切成 用 / Python / 写 三个词，与索引一致
+QUERY_TOKEN_RE = re.compile(f"[{CJK_RANGES}]+|[^\\W{CJK_RANGES}]+")
+SNIPPET_RADIUS = 20
+
+
+def segment_run(run):
+    # “会话列表” -> “会话 话列 列表 表”：末字单独保留，供单字前缀查询命中
+    if len(run) == 1:
+        return run
+    return " ".join([run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]])
+
+
+# 写入索引前的文本：中日韩字符段替换为二元组，其余原样保留
+def segment_text(text):
+    return CJK_RUN_RE.sub(lambda m: f" {segment_run(m.group())} ", text)
+
+
+# 用户输入 -> FTS5查询串；没有可检索内容时返回None
+def build_fts_query(query):
+    terms = []
+    for token in QUERY_TOKEN_RE.findall(query):
+        if CJK_RUN_RE.fullmatch(token):
+            if len(token) == 1:
+                terms.append(f'"{token}"*')
+            else:
+                bigrams = " ".join(token[i:i + 2] for i in range(len(token) - 1))
+                terms.append(f'"{bigrams}"')
+        else:
+            terms.append('"{}"'.format(token.replace('"', '""')))
+    return " ".join(terms) if terms else None
+
+
+# 结果摘要：截取第一个命中词附近的文字
+def make_snippet(content, query):
+    lowered = content.lower()
+    position = -1
+    for token in QUERY_TOKEN_RE.findall(query.lower()):
+        position = lowered.find(token)
+        if position >= 0:
+            break
+    if position < 0:
+        return content[:SNIPPET_RADIUS * 2].replace("\n", " ")
+    start = max(0, position - SNIPPET_RADIUS)
+    snippet = content[start:position + SNIPPET_RADIUS * 2].replace("\n", " ")
+    return ("…" if start > 0 else "") + snippet
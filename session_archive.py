@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷会话归档编码（配合SessionStore使用）
+优化点：1. 整个会话的消息打包成一个压缩块，装了zstandard时用zstd，否则用zlib
+        2. 每个块记录编码方式，两种格式可以混存、随时切换
+"""
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_LEVEL = 9  # 归档只写一次，用最高压缩率
+ZSTD_LEVEL = 10
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress(raw, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress(blob, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("该会话以zstd归档，需要安装zstandard才能恢复")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+# rows为 (id, role, content, time, tokens)，保留原消息ID，恢复后搜索索引仍然有效
+def pack_messages(rows, codec=None):
+    codec = codec or default_codec()
+    raw = json.dumps([list(row) for row in rows], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return codec, compress(raw, codec), len(raw)
+
+
+def unpack_messages(blob, codec):
+    return [tuple(row) for row in json.loads(decompress(blob, codec).decode("utf-8"))]
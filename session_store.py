@@ -0,0 +1,795 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话存储引擎（SQLite WAL模式）
+优化点：1. 追加一轮对话只写入新增行（O(1)） 2. 当前会话指针单独存储 3. 首次启动自动迁移旧版sessions.json
+        4. 启动只加载元数据，消息正文按页读取，读过的消息页放入有内存预算的LRU缓存 5. 按token预算组装上下文，token数随消息入库缓存
+        6. FTS5全文索引（中文二元组分词），随消息写入增量维护 7. 待发送消息持久化队列（outbox），重启后继续投递
+        8. 长期未打开的会话整体压缩归档，打开时自动恢复；归档期间仍可被全文搜索
+        9. 按会话分批导出/导入（配合session_transfer使用）
+"""
+import json
+import os
+import sqlite3
+import datetime
+import threading
+from collections import OrderedDict
+from context_window import estimate_tokens, context_budget, assemble_context
+from search_index import segment_text, build_fts_query, make_snippet
+from session_archive import pack_messages, unpack_messages
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. Answer questions clearly and concisely."
+# 数据库结构版本（PRAGMA user_version）
+SCHEMA_VERSION = 5
+# 搜索结果条数上限
+SEARCH_LIMIT = 50
+# 已读取消息页的内存预算（按消息字符数估算，单位：字节）
+SESSION_CACHE_BUDGET = 8 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    last_msg TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT '',
+    position INTEGER NOT NULL,
+    system_prompt TEXT,
+    cache_enabled INTEGER NOT NULL DEFAULT 0,
+    archived INTEGER NOT NULL DEFAULT 0,
+    accessed TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    time TEXT NOT NULL DEFAULT '',
+    tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL DEFAULT 0,
+    content TEXT NOT NULL,
+    time TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS archives (
+    session_id TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    message_count INTEGER NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived_messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
+"""
+
+
+def now_timestamp():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+def now_time():
+    return datetime.datetime.now().strftime("%H:%M")
+
+
+def now_epoch():
+    return datetime.datetime.now().timestamp()
+
+
+# 冷会话判定：最近打开和最近消息都早于此时间
+def cold_cutoff(days):
+    return (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M")
+
+
+# ========== 存储引擎：所有SQL集中在这里 ==========
+class SessionStore:
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        # 每个线程各用一个SessionStore（App的连接在启动线程打开、之后只在主线程使用，所以关闭同线程检查）；
+        # 写事务仍统一经过锁，同一连接上的多步写入不会交错
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # 供SQL批量写索引时调用的分词函数
+        self.conn.create_function("segment_text", 1, segment_text, deterministic=True)
+        self.conn.executescript(SCHEMA)
+        self.upgrade_schema()
+        self.ensure_search_index()
+
+        if legacy_json_path and os.path.exists(legacy_json_path) and self.session_count() == 0:
+            self.migrate_json(legacy_json_path)
+        if self.session_count() == 0:
+            self.create_session({
+                "id": "default",
+                "name": "默认会话",
+                "last_msg": "暂无消息",
+                "timestamp": now_timestamp(),
+                "system_prompt": DEFAULT_SYSTEM_PROMPT
+            })
+        if self.get_current_session_id() is None:
+            self.set_current_session_id("default")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # ========== 数据库结构升级 ==========
+    def column_names(self, table):
+        return [row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def upgrade_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self.lock, self.conn:
+            if version < 2:
+                self.upgrade_v2()
+            if version < 3:
+                # v3：会话级回复缓存开关
+                if "cache_enabled" not in self.column_names("sessions"):
+                    self.conn.execute("ALTER TABLE sessions ADD COLUMN cache_enabled INTEGER NOT NULL DEFAULT 0")
+            if version < 4:
+                # v4：冷会话归档，accessed记录最近一次打开的时间
+                columns = self.column_names("sessions")
+                if "archived" not in columns:
+                    self.conn.execute("ALTER TABLE sessions ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+                if "accessed" not in columns:
+                    self.conn.execute("ALTER TABLE sessions ADD COLUMN accessed TEXT NOT NULL DEFAULT ''")
+                self.conn.execute("UPDATE sessions SET accessed = timestamp WHERE accessed = ''")
+            if version < 5:
+                # v5：提问在投递开始时才写入messages，发送时间先存在outbox中
+                if "time" not in self.column_names("outbox"):
+                    self.conn.execute("ALTER TABLE outbox ADD COLUMN time TEXT NOT NULL DEFAULT ''")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def upgrade_v2(self):
+        # v2：context表（固定20条）改为按需组装；system prompt存到sessions，消息token数存到messages
+        if "system_prompt" not in self.column_names("sessions"):
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN system_prompt TEXT")
+        if "tokens" not in self.column_names("messages"):
+            self.conn.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+        has_context = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'context'").fetchone()
+        if has_context:
+            # 旧版裁剪可能已经切掉了system prompt，这种会话恢复为默认提示
+            self.conn.execute(
+                "UPDATE sessions SET system_prompt = COALESCE("
+                "(SELECT content FROM context WHERE context.session_id = sessions.id AND role = 'system' "
+                "ORDER BY id LIMIT 1), ?)", (DEFAULT_SYSTEM_PROMPT,))
+            self.conn.execute("DROP TABLE context")
+
+    # ========== 全文索引：SQLite未编译FTS5时退化为LIKE查询 ==========
+    def ensure_search_index(self):
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").fetchone()
+        if exists:
+            self.fts_enabled = True
+            return
+        try:
+            with self.lock, self.conn:
+                self.conn.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(body, tokenize = 'unicode61', prefix = '1')")
+                # 已有消息一次性补建索引
+                self.conn.execute("INSERT INTO messages_fts (rowid, body) SELECT id, segment_text(content) FROM messages")
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            self.fts_enabled = False
+
+    def index_message(self, message_id, content):
+        if self.fts_enabled:
+            self.conn.execute("INSERT INTO messages_fts (rowid, body) VALUES (?, ?)",
+                              (message_id, segment_text(content)))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        if self.fts_enabled:
+            fts_query = build_fts_query(query)
+            if fts_query is None:
+                return []
+            # 归档会话的消息已不在messages表中，但索引保留，通过archived_messages找到所属会话
+            rows = self.conn.execute(
+                "SELECT f.rowid AS id, s.id AS session_id, m.role, m.content, s.name FROM messages_fts f "
+                "LEFT JOIN messages m ON m.id = f.rowid LEFT JOIN archived_messages a ON a.id = f.rowid "
+                "JOIN sessions s ON s.id = COALESCE(m.session_id, a.session_id) "
+                "WHERE messages_fts MATCH ? ORDER BY f.rowid DESC LIMIT ?",
+                (fts_query, limit)).fetchall()
+        else:
+            # 无FTS5时只能搜索未归档的消息
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = self.conn.execute(
+                "SELECT m.id, m.session_id, m.role, m.content, s.name FROM messages m "
+                "JOIN sessions s ON s.id = m.session_id "
+                "WHERE m.content LIKE ? ESCAPE '\\' ORDER BY m.id DESC LIMIT ?",
+                (pattern, limit)).fetchall()
+        archived = {}
+        results = []
+        for row in rows:
+            role, content = row["role"], row["content"]
+            if content is None:
+                # 命中归档会话：每个会话只解压一次
+                session_id = row["session_id"]
+                if session_id not in archived:
+                    archived[session_id] = {r[0]: r for r in self.load_archive(session_id)}
+                message = archived[session_id].get(row["id"])
+                if message is None:
+                    continue
+                role, content = message[1], message[2]
+            results.append({
+                "message_id": row["id"],
+                "session_id": row["session_id"],
+                "session_name": row["name"],
+                "role": role,
+                "snippet": make_snippet(content, query)
+            })
+        return results
+
+    # ========== 旧版sessions.json迁移（单事务，失败则整体回滚） ==========
+    def migrate_json(self, json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self.lock, self.conn:
+            for position, session in enumerate(data.get("sessions", [])):
+                system_prompt = next((c["content"] for c in session.get("context", []) if c["role"] == "system"),
+                                     DEFAULT_SYSTEM_PROMPT)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions (id, name, last_msg, timestamp, position, system_prompt) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (session["id"], session.get("name", ""), session.get("last_msg", ""),
+                     session.get("timestamp", ""), position, system_prompt))
+                self.conn.executemany(
+                    "INSERT INTO messages (session_id, role, content, time, tokens) VALUES (?, ?, ?, ?, ?)",
+                    [(session["id"], m["role"], m["content"], m.get("time", ""), estimate_tokens(m["content"]))
+                     for m in session.get("messages", [])])
+                if self.fts_enabled:
+                    self.conn.execute(
+                        "INSERT INTO messages_fts (rowid, body) SELECT id, segment_text(content) FROM messages "
+                        "WHERE session_id = ?", (session["id"],))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('current_session', ?)",
+                (data.get("current_session", "default"),))
+        # 保留旧文件作为备份，避免重复迁移
+        os.replace(json_path, json_path + ".migrated")
+
+    # ========== 当前会话指针（只改一行） ==========
+    def get_current_session_id(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'current_session'").fetchone()
+        return row["value"] if row else None
+
+    def set_current_session_id(self, session_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('current_session', ?)", (session_id,))
+
+    # ========== 会话元数据 ==========
+    def session_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def list_sessions(self):
+        rows = self.conn.execute(
+            "SELECT id, name, last_msg, timestamp, cache_enabled, archived FROM sessions ORDER BY position").fetchall()
+        sessions = [dict(row) for row in rows]
+        for session in sessions:
+            session["cache_enabled"] = bool(session["cache_enabled"])
+            session["archived"] = bool(session["archived"])
+        return sessions
+
+    # 分页读取：返回before_id之前最新的limit条（按时间正序）
+    def load_message_page(self, session_id, before_id=None, limit=50):
+        if before_id is None:
+            rows = self.conn.execute(
+                "SELECT id, role, content, time FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)).fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT id, role, content, time FROM messages WHERE session_id = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, before_id, limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def load_messages_after(self, session_id, after_id, limit=50):
+        rows = self.conn.execute(
+            "SELECT id, role, content, time FROM messages WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (session_id, after_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    # 搜索结果定位：目标消息前后各取一半
+    def load_message_window(self, session_id, around_id, limit=50):
+        half = limit // 2
+        before = self.conn.execute(
+            "SELECT id, role, content, time FROM messages WHERE session_id = ? AND id <= ? "
+            "ORDER BY id DESC LIMIT ?", (session_id, around_id, half)).fetchall()
+        after = self.conn.execute(
+            "SELECT id, role, content, time FROM messages WHERE session_id = ? AND id > ? "
+            "ORDER BY id LIMIT ?", (session_id, around_id, half)).fetchall()
+        return [dict(row) for row in reversed(before)] + [dict(row) for row in after]
+
+    # 排队中的提问还没写入messages，同样算作有消息
+    def has_messages(self, session_id):
+        row = self.conn.execute(
+            "SELECT 1 FROM messages WHERE session_id = ? UNION ALL SELECT 1 FROM outbox WHERE session_id = ? LIMIT 1",
+            (session_id, session_id)).fetchone()
+        return row is not None
+
+    def get_system_prompt(self, session_id):
+        row = self.conn.execute("SELECT system_prompt FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row["system_prompt"] if row else None
+
+    # ========== 按token预算组装上下文：从最新消息往前读，预算用完即停止 ==========
+    # before_id：只取这条消息之前的历史（投递开始时提问已入库，不能重复发送）
+    def build_context(self, session_id, user_msg, budget, before_id=None):
+        backfill = []
+
+        def history():
+            if before_id is None:
+                cursor = self.conn.execute(
+                    "SELECT id, role, content, tokens FROM messages WHERE session_id = ? ORDER BY id DESC",
+                    (session_id,))
+            else:
+                cursor = self.conn.execute(
+                    "SELECT id, role, content, tokens FROM messages WHERE session_id = ? AND id < ? "
+                    "ORDER BY id DESC", (session_id, before_id))
+            for row in cursor:
+                tokens = row["tokens"]
+                if tokens is None:
+                    # 旧数据首次使用时补算并回写
+                    tokens = estimate_tokens(row["content"])
+                    backfill.append((tokens, row["id"]))
+                yield row["role"], row["content"], tokens
+
+        messages = assemble_context(self.get_system_prompt(session_id), history(), user_msg, budget)
+        if backfill:
+            with self.lock, self.conn:
+                self.conn.executemany("UPDATE messages SET tokens = ? WHERE id = ?", backfill)
+        return messages
+
+    def create_session(self, session):
+        with self.lock, self.conn:
+            position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM sessions").fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO sessions (id, name, last_msg, timestamp, position, system_prompt, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session["id"], session["name"], session["last_msg"], session["timestamp"], position,
+                 session.get("system_prompt"), session["timestamp"]))
+
+    def rename_session(self, session_id, new_name):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE sessions SET name = ? WHERE id = ?", (new_name, session_id))
+
+    def set_cache_enabled(self, session_id, enabled):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE sessions SET cache_enabled = ? WHERE id = ?", (int(enabled), session_id))
+
+    def delete_session(self, session_id):
+        with self.lock, self.conn:
+            if self.fts_enabled:
+                self.conn.execute(
+                    "DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE session_id = ? "
+                    "UNION ALL SELECT id FROM archived_messages WHERE session_id = ?)", (session_id, session_id))
+            self.conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM archived_messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM archives WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM outbox WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def insert_message(self, session_id, role, content, time):
+        cursor = self.conn.execute(
+            "INSERT INTO messages (session_id, role, content, time, tokens) VALUES (?, ?, ?, ?, ?)",
+            (session_id, role, content, time, estimate_tokens(content)))
+        self.index_message(cursor.lastrowid, content)
+        return cursor.lastrowid
+
+    # ========== 待发送队列：提问先进outbox，断网/重启都不丢 ==========
+    # 提问在投递开始时才写入messages（此时同一会话的上一条回复已写回），保证消息顺序为一问一答；
+    # message_id为0表示提问还只在outbox中
+    def enqueue_message(self, session_id, content, time, timestamp):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (session_id, content, time, created) VALUES (?, ?, ?, ?)",
+                (session_id, content, time, now_epoch()))
+            self.conn.execute(
+                "UPDATE sessions SET last_msg = ?, timestamp = ? WHERE id = ?",
+                (content[:30], timestamp, session_id))
+        return {"id": cursor.lastrowid, "session_id": session_id, "message_id": 0,
+                "content": content, "time": time, "attempts": 0, "next_attempt": 0}
+
+    def pending_outbox(self):
+        rows = self.conn.execute(
+            "SELECT id, session_id, message_id, content, time, attempts, next_attempt FROM outbox "
+            "ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    # 首次投递时写入提问；重试时已写入，直接返回原ID
+    def start_outbox(self, outbox_id, session_id, content, time):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT message_id FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+            if row is not None and row["message_id"]:
+                return row["message_id"]
+            message_id = self.insert_message(session_id, "user", content, time)
+            self.conn.execute("UPDATE outbox SET message_id = ? WHERE id = ?", (message_id, outbox_id))
+        return message_id
+
+    def complete_outbox(self, outbox_id, session_id, reply, time):
+        with self.lock, self.conn:
+            self.insert_message(session_id, "grok", reply, time)
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+
+    def reschedule_outbox(self, outbox_id, attempts, next_attempt, error):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt, error, outbox_id))
+
+    # 放弃投递：已写入的提问没有回复，一并撤回，否则下次组装上下文会出现连续两条提问
+    def drop_outbox(self, outbox_id):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT message_id FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+            if row is not None and row["message_id"]:
+                if self.fts_enabled:
+                    self.conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (row["message_id"],))
+                self.conn.execute("DELETE FROM messages WHERE id = ?", (row["message_id"],))
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+
+    # ========== 冷会话归档：消息整体压缩成一个块，全文索引保留 ==========
+    def touch_session(self, session_id):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE sessions SET accessed = ? WHERE id = ?", (now_timestamp(), session_id))
+
+    # 最近打开和最近消息都早于cutoff、有消息且没有待发送消息的会话
+    def cold_sessions(self, cutoff, limit):
+        rows = self.conn.execute(
+            "SELECT id FROM sessions WHERE archived = 0 AND accessed < ? AND timestamp < ? "
+            "AND EXISTS (SELECT 1 FROM messages WHERE session_id = sessions.id) "
+            "AND id NOT IN (SELECT session_id FROM outbox) ORDER BY accessed LIMIT ?",
+            (cutoff, cutoff, limit)).fetchall()
+        return [row["id"] for row in rows]
+
+    # 可在后台线程用独立连接调用；cutoff与cold_sessions相同，压缩期间会话被打开或有新消息时放弃归档
+    def archive_session(self, session_id, cutoff):
+        rows = self.conn.execute(
+            "SELECT id, role, content, time, tokens FROM messages WHERE session_id = ? ORDER BY id",
+            (session_id,)).fetchall()
+        if not rows:
+            return False  # 空会话没有可压缩的内容
+        # 压缩在写事务之外进行，不占用数据库写锁
+        codec, blob, raw_bytes = pack_messages([tuple(row) for row in rows])
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE sessions SET archived = 1 WHERE id = ? AND archived = 0 AND accessed < ? "
+                "AND id NOT IN (SELECT session_id FROM outbox) "
+                "AND (SELECT MAX(id) FROM messages WHERE session_id = ?) = ?",
+                (session_id, cutoff, session_id, rows[-1]["id"]))
+            if cursor.rowcount == 0:
+                return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO archives (session_id, codec, data, message_count, raw_bytes, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (session_id, codec, blob, len(rows), raw_bytes, now_timestamp()))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO archived_messages (id, session_id) "
+                "SELECT id, session_id FROM messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        return True
+
+    # 归档全部冷会话（exclude为正在使用的会话），逐个提交；App在后台线程用独立连接调用。
+    # should_stop返回True时提前结束，on_archived在每个会话归档后调用；返回已归档的会话ID
+    def archive_cold(self, cutoff, exclude=(), should_stop=None, on_archived=None):
+        archived = []
+        for session_id in self.cold_sessions(cutoff, self.session_count()):
+            if should_stop is not None and should_stop():
+                break
+            # 开始后被打开或收到新消息的会话由archive_session放弃
+            if session_id in exclude or not self.archive_session(session_id, cutoff):
+                continue
+            archived.append(session_id)
+            if on_archived is not None:
+                on_archived(session_id)
+        return archived
+
+    def is_archived(self, session_id):
+        row = self.conn.execute("SELECT archived FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None and bool(row["archived"])
+
+    def load_archive(self, session_id):
+        row = self.conn.execute("SELECT codec, data FROM archives WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return []
+        return unpack_messages(row["data"], row["codec"])
+
+    def restore_session(self, session_id):
+        with self.lock, self.conn:
+            # 按原ID写回，全文索引和搜索结果定位无需改动
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, session_id, role, content, time, tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(row[0], session_id) + tuple(row[1:]) for row in self.load_archive(session_id)])
+            self.conn.execute("DELETE FROM archived_messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM archives WHERE session_id = ?", (session_id,))
+            self.conn.execute("UPDATE sessions SET archived = 0, accessed = ? WHERE id = ?",
+                              (now_timestamp(), session_id))
+
+    # ========== 存储占用报告 ==========
+    def storage_report(self):
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        files = 0
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                files += os.path.getsize(self.db_path + suffix)
+        hot = self.conn.execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(*), COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) "
+            "FROM messages").fetchone()
+        cold = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(raw_bytes), 0), "
+            "COALESCE(SUM(LENGTH(data)), 0) FROM archives").fetchone()
+        return {
+            "file_bytes": files,
+            "free_bytes": free_pages * page_size,
+            "used_bytes": (page_count - free_pages) * page_size,
+            "sessions": self.session_count(),
+            "hot_sessions": hot[0],
+            "hot_messages": hot[1],
+            "hot_text_bytes": hot[2],
+            "archived_sessions": cold[0],
+            "archived_messages": cold[1],
+            "archived_raw_bytes": cold[2],
+            "archived_bytes": cold[3]
+        }
+
+    # 归档后空出的页只会被复用，整理后才会缩小文件
+    def vacuum(self):
+        with self.lock:
+            self.conn.execute("VACUUM")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # ========== 批量导出/导入：按会话、按批读写，内存占用与档案总大小无关 ==========
+    def export_sessions(self):
+        rows = self.conn.execute(
+            "SELECT id, name, last_msg, timestamp, system_prompt, cache_enabled FROM sessions "
+            "ORDER BY position").fetchall()
+        return [dict(row) for row in rows]
+
+    # 逐批返回 [(role, content, time), ...]；归档会话解压后同样分批
+    def iter_message_batches(self, session_id, batch_size):
+        archived = self.conn.execute("SELECT archived FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if archived is not None and archived["archived"]:
+            rows = [row[1:4] for row in self.load_archive(session_id)]
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+        # 独立游标，导出期间界面线程仍可读写
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT role, content, time FROM messages WHERE session_id = ? ORDER BY id", (session_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+    # 导入到已有会话前调用：会话不存在返回False；归档会话先恢复，之后才能追加消息
+    def prepare_import(self, session_id):
+        row = self.conn.execute("SELECT archived FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return False
+        if row["archived"]:
+            self.restore_session(session_id)
+        return True
+
+    def import_session(self, session):
+        with self.lock, self.conn:
+            position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM sessions").fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO sessions (id, name, last_msg, timestamp, position, system_prompt, cache_enabled, "
+                "accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (session["id"], session.get("name", ""), session.get("last_msg", ""), session.get("timestamp", ""),
+                 position, session.get("system_prompt"), int(bool(session.get("cache_enabled"))),
+                 session.get("timestamp", "")))
+
+    # 合并到已有会话时，导入档案中的会话更新则采用它的摘要
+    def merge_session_meta(self, session):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE sessions SET last_msg = ?, timestamp = ? WHERE id = ? AND timestamp < ?",
+                (session.get("last_msg", ""), session.get("timestamp", ""), session["id"],
+                 session.get("timestamp", "")))
+
+    def import_messages(self, session_id, messages):
+        with self.lock, self.conn:
+            for role, content, time in messages:
+                self.insert_message(session_id, role, content, time)
+
+
+# 会话管理类（持久化交给SessionStore）
+# sessions只保存元数据（name/last_msg/timestamp），消息正文按页读取，最近读过的页留在LRU缓存中
+class SessionManager:
+    def __init__(self, db_path, legacy_json_path=None, cache_budget=SESSION_CACHE_BUDGET):
+        self.store = SessionStore(db_path, legacy_json_path)
+        self.cache_budget = cache_budget
+        self.load_sessions()
+
+    def load_sessions(self):
+        self.current_session_id = self.store.get_current_session_id()
+        self.sessions = self.store.list_sessions()
+        self.session_index = {s["id"]: s for s in self.sessions}
+        # LRU：(session_id, before_id, limit) -> (消息页, 估算占用字节数)；导入后重新加载时一并清空
+        self.pages = OrderedDict()
+        self.pages_bytes = 0
+
+    # 本次请求要发送的messages（system prompt + 预算内的最近历史 + 本次提问）
+    def build_context(self, session_id, user_msg, model, before_id=None):
+        return self.store.build_context(session_id, user_msg, context_budget(model), before_id)
+
+    # ========== 消息页LRU缓存：切回最近打开过的会话不必再读库 ==========
+    @staticmethod
+    def estimate_size(page):
+        size = 0
+        for item in page:
+            size += len(item["content"]) * 2 + 64
+        return size
+
+    def get_message_page(self, session_id, before_id=None, limit=50):
+        key = (session_id, before_id, limit)
+        cached = self.pages.get(key)
+        if cached is not None:
+            self.pages.move_to_end(key)
+            return cached[0]
+        page = self.store.load_message_page(session_id, before_id, limit)
+        size = self.estimate_size(page)
+        self.pages[key] = (page, size)
+        self.pages_bytes += size
+        self.evict()
+        return page
+
+    def evict(self):
+        # 至少保留最近读取的一页，即使它本身超出预算
+        while self.pages_bytes > self.cache_budget and len(self.pages) > 1:
+            _, (_, size) = self.pages.popitem(last=False)
+            self.pages_bytes -= size
+
+    # 会话消息有增删或归档状态变化时丢弃它的所有缓存页
+    def invalidate(self, session_id):
+        for key in [key for key in self.pages if key[0] == session_id]:
+            self.pages_bytes -= self.pages.pop(key)[1]
+
+    def get_messages_after(self, session_id, after_id, limit=50):
+        return self.store.load_messages_after(session_id, after_id, limit)
+
+    def get_message_window(self, session_id, around_id, limit=50):
+        return self.store.load_message_window(session_id, around_id, limit)
+
+    def search(self, query):
+        return self.store.search(query)
+
+    def has_messages(self, session_id):
+        if self.session_index[session_id]["archived"]:
+            return True  # 只有非空会话会被归档
+        return self.store.has_messages(session_id)
+
+    def get_session_meta(self, session_id):
+        return self.session_index[session_id]
+
+    def get_current_session_meta(self):
+        return self.session_index[self.current_session_id]
+
+    def set_current_session(self, session_id):
+        self.current_session_id = session_id
+        self.store.set_current_session_id(session_id)
+        if not self.restore(session_id):
+            self.store.touch_session(session_id)
+
+    # ========== 冷会话归档 ==========
+    # 打开归档会话时解压写回，恢复为普通会话；返回是否做了恢复
+    # 归档在后台线程进行，会话列表中的标记可能稍晚更新，以数据库中的状态为准
+    def restore(self, session_id):
+        session = self.session_index.get(session_id)
+        if session is None or not self.store.is_archived(session_id):
+            return False
+        self.store.restore_session(session_id)
+        self.invalidate(session_id)
+        session["archived"] = False
+        return True
+
+    # 归档后调用，同步会话列表中的标记；后台归档的会话在回调前可能已被打开恢复，同样以数据库为准
+    def mark_archived(self, session_id):
+        session = self.session_index.get(session_id)
+        if session is not None:
+            self.invalidate(session_id)
+            session["archived"] = self.store.is_archived(session_id)
+
+    def storage_report(self):
+        return self.store.storage_report()
+
+    def create_session(self, first_msg="新会话"):
+        session_id = f"session_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # 同一秒内连续新建时追加序号，避免主键冲突
+        suffix = 1
+        while session_id in self.session_index:
+            session_id = f"session_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{suffix}"
+            suffix += 1
+        new_session = {
+            "id": session_id,
+            "name": first_msg[:20],
+            "last_msg": first_msg[:30],
+            "timestamp": now_timestamp(),
+            # 新会话也加入system prompt
+            "system_prompt": DEFAULT_SYSTEM_PROMPT,
+            "cache_enabled": False,
+            "archived": False
+        }
+        self.store.create_session(new_session)
+        self.sessions.append(new_session)
+        self.session_index[session_id] = new_session
+        self.set_current_session(session_id)
+        return session_id
+
+    def rename_session(self, session_id, new_name):
+        self.session_index[session_id]["name"] = new_name
+        self.store.rename_session(session_id, new_name)
+
+    # 回复缓存开关（按会话保存）
+    def set_cache_enabled(self, session_id, enabled):
+        self.session_index[session_id]["cache_enabled"] = enabled
+        self.store.set_cache_enabled(session_id, enabled)
+
+    def delete_session(self, session_id):
+        if session_id == "default":
+            return False
+        self.store.delete_session(session_id)
+        self.invalidate(session_id)
+        self.session_index.pop(session_id, None)
+        self.sessions = [s for s in self.sessions if s["id"] != session_id]
+        self.set_current_session("default")
+        return True
+
+    # ========== 待发送队列（outbox） ==========
+    def enqueue_message(self, session_id, user_msg):
+        self.restore(session_id)
+        session = self.session_index[session_id]
+        time = now_time()
+        timestamp = now_timestamp()
+        entry = self.store.enqueue_message(session_id, user_msg, time, timestamp)
+        self.invalidate(session_id)
+        session["last_msg"] = user_msg[:30]
+        session["timestamp"] = timestamp
+        return entry
+
+    def pending_outbox(self):
+        return self.store.pending_outbox()
+
+    # 还没开始投递、只在outbox中的提问，打开会话时接在聊天记录末尾显示
+    def queued_messages(self, session_id):
+        return [entry for entry in self.store.pending_outbox()
+                if entry["session_id"] == session_id and not entry["message_id"]]
+
+    def start_outbox(self, entry):
+        if not entry["message_id"]:
+            entry["message_id"] = self.store.start_outbox(entry["id"], entry["session_id"], entry["content"],
+                                                          entry["time"])
+            self.invalidate(entry["session_id"])
+        return entry["message_id"]
+
+    def complete_outbox(self, entry, reply):
+        self.store.complete_outbox(entry["id"], entry["session_id"], reply, now_time())
+        self.invalidate(entry["session_id"])
+
+    def reschedule_outbox(self, entry, delay, error):
+        entry["attempts"] += 1
+        entry["next_attempt"] = now_epoch() + delay
+        self.store.reschedule_outbox(entry["id"], entry["attempts"], entry["next_attempt"], error)
+
+    def drop_outbox(self, entry):
+        self.store.drop_outbox(entry["id"])
+        if entry["message_id"]:
+            self.invalidate(entry["session_id"])
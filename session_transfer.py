@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话档案批量导出/导入（与界面无关，可在桌面命令行直接使用）
+优化点：1. 按会话、按批流式读写，内存占用只与单批消息有关，GB级档案也能在手机上处理
+        2. 两种格式：JSONL（每行一条记录，便于分析）和紧凑二进制（每批压缩成一帧）
+        3. 导入按会话ID合并、按消息哈希去重，同一份档案重复导入不会产生重复消息 4. 进度回调
+
+用法：python session_transfer.py export sessions.db backup.gcx
+      python session_transfer.py export sessions.db backup.jsonl
+      python session_transfer.py import sessions.db backup.gcx
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import struct
+import hashlib
+import argparse
+from collections import Counter
+from session_store import SessionStore
+from session_archive import default_codec, compress, decompress, zstandard
+
+FORMAT_NAME = "grokchat-export"
+FORMAT_VERSION = 1
+BATCH_SIZE = 500  # 每批（每帧）消息数
+# 二进制格式：文件头 + 若干帧；帧头为 类型(1字节) + 编码(1字节) + 长度(4字节)，内容为压缩后的JSON
+MAGIC = b"GCX1"
+FRAME_HEADER = struct.Struct("<BBI")
+FRAME_SESSION, FRAME_MESSAGES, FRAME_END = 1, 2, 3
+CODEC_IDS = {"zlib": 1, "zstd": 2}
+CODEC_NAMES = {value: name for name, value in CODEC_IDS.items()}
+PROGRESS_INTERVAL = 0.5  # 进度回调的最小间隔（秒）
+
+
+class TransferError(Exception):
+    pass
+
+
+def message_hash(role, content, msg_time):
+    return hashlib.blake2b(f"{role}\0{content}\0{msg_time}".encode("utf-8"), digest_size=16).digest()
+
+
+def detect_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "binary"
+
+
+# ========== 写入端：两种格式实现同样的三个方法 ==========
+class JsonlWriter:
+    def __init__(self, f):
+        self.f = f
+        self.write_record({"type": "header", "format": FORMAT_NAME, "version": FORMAT_VERSION})
+
+    def write_record(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def session(self, session):
+        self.write_record({"type": "session", **session})
+
+    def messages(self, session_id, rows):
+        for role, content, msg_time in rows:
+            self.write_record({"type": "message", "session_id": session_id, "role": role, "content": content,
+                               "time": msg_time})
+
+    def end(self, counts):
+        self.write_record({"type": "end", **counts})
+
+
+class BinaryWriter:
+    def __init__(self, f, codec=None):
+        self.f = f
+        self.codec = codec or default_codec()
+        f.write(MAGIC)
+
+    def frame(self, kind, payload):
+        data = compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), self.codec)
+        self.f.write(FRAME_HEADER.pack(kind, CODEC_IDS[self.codec], len(data)))
+        self.f.write(data)
+
+    def session(self, session):
+        self.frame(FRAME_SESSION, session)
+
+    def messages(self, session_id, rows):
+        self.frame(FRAME_MESSAGES, [list(row) for row in rows])
+
+    def end(self, counts):
+        self.frame(FRAME_END, counts)
+
+
+# ========== 读取端：统一产出 ("session", dict) / ("messages", [(role, content, time)]) / ("end", dict) ==========
+# 解码失败（压缩数据损坏、JSON不合法）和记录缺字段都转成TransferError，调用方只需处理这一种
+DECODE_ERRORS = (zlib.error, ValueError, RuntimeError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def check_session(record):
+    if not isinstance(record, dict) or not isinstance(record.get("id"), str):
+        raise TransferError("会话记录缺少id，档案已损坏")
+    return record
+
+
+def check_rows(rows):
+    if not isinstance(rows, list) or not all(
+            isinstance(row, (list, tuple)) and len(row) == 3 and all(isinstance(value, str) for value in row)
+            for row in rows):
+        raise TransferError("消息记录格式不正确，档案已损坏")
+    return [tuple(row) for row in rows]
+
+
+def read_jsonl(f):
+    try:
+        header = json.loads(f.readline() or b"{}")
+    except DECODE_ERRORS:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT_NAME:
+        raise TransferError("不是GrokChat导出的JSONL文件")
+    batch = []
+    for line_no, line in enumerate(f, 2):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except DECODE_ERRORS:
+            raise TransferError(f"第{line_no}行不是合法的JSON，档案已损坏")
+        kind = record.pop("type", None) if isinstance(record, dict) else None
+        if kind == "message":
+            batch.extend(check_rows([[record.get("role"), record.get("content"), record.get("time", "")]]))
+            if len(batch) >= BATCH_SIZE:
+                yield "messages", batch
+                batch = []
+            continue
+        if batch:
+            yield "messages", batch
+            batch = []
+        if kind == "session":
+            yield kind, check_session(record)
+        elif kind == "end":
+            yield kind, record
+    if batch:
+        yield "messages", batch
+
+
+def read_binary(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise TransferError("不是GrokChat导出的二进制文件")
+    while True:
+        header = f.read(FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise TransferError("文件在帧头处被截断")
+        kind, codec_id, length = FRAME_HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length or codec_id not in CODEC_NAMES:
+            raise TransferError("文件在帧内容处被截断或已损坏")
+        try:
+            payload = json.loads(decompress(data, CODEC_NAMES[codec_id]).decode("utf-8"))
+        except DECODE_ERRORS as e:
+            raise TransferError(f"帧内容无法解码，档案已损坏（{e}）")
+        if kind == FRAME_SESSION:
+            yield "session", check_session(payload)
+        elif kind == FRAME_MESSAGES:
+            yield "messages", check_rows(payload)
+        elif kind == FRAME_END:
+            yield "end", payload if isinstance(payload, dict) else {}
+
+
+# 进度回调：progress(done, total, counts)，导出时按会话数、导入时按已读字节数
+class ProgressThrottle:
+    def __init__(self, progress):
+        self.progress = progress
+        self.last = 0.0
+
+    def __call__(self, done, total, counts, force=False):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if force or now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.progress(done, total, counts)
+
+
+def export_archive(store, path, fmt=None, progress=None, batch_size=BATCH_SIZE):
+    fmt = fmt or detect_format(path)
+    report = ProgressThrottle(progress)
+    sessions = store.export_sessions()
+    counts = {"sessions": 0, "messages": 0}
+    # 先写临时文件，完成后再替换，中途失败不会留下半个备份
+    temp_path = path + ".part"
+    with open(temp_path, "wb") as f:
+        writer = JsonlWriter(f) if fmt == "jsonl" else BinaryWriter(f)
+        for session in sessions:
+            session["cache_enabled"] = bool(session["cache_enabled"])
+            writer.session(session)
+            for rows in store.iter_message_batches(session["id"], batch_size):
+                writer.messages(session["id"], rows)
+                counts["messages"] += len(rows)
+            counts["sessions"] += 1
+            report(counts["sessions"], len(sessions), counts)
+        writer.end(counts)
+    os.replace(temp_path, path)
+    report(counts["sessions"], len(sessions), counts, force=True)
+    return counts
+
+
+# 导入：新会话整体写入；已有的会话按消息哈希去重后追加（按次数抵消，会话内本来就重复的消息也能保留）
+def import_archive(store, path, progress=None):
+    report = ProgressThrottle(progress)
+    total = os.path.getsize(path)
+    counts = {"sessions": 0, "merged_sessions": 0, "messages": 0, "duplicates": 0}
+    with open(path, "rb") as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+        f.seek(0)
+        records = read_binary(f) if binary else read_jsonl(f)
+        session_id = None
+        existing = Counter()
+        ended = False
+        for kind, record in records:
+            if kind == "session":
+                session_id = record["id"]
+                existing = Counter()
+                if store.prepare_import(session_id):
+                    counts["merged_sessions"] += 1
+                    for rows in store.iter_message_batches(session_id, BATCH_SIZE):
+                        existing.update(message_hash(*row) for row in rows)
+                    store.merge_session_meta(record)
+                else:
+                    counts["sessions"] += 1
+                    store.import_session(record)
+            elif kind == "messages":
+                if session_id is None:
+                    raise TransferError("消息记录出现在会话记录之前")
+                fresh = []
+                for row in record:
+                    digest = message_hash(*row)
+                    if existing[digest]:
+                        existing[digest] -= 1
+                        counts["duplicates"] += 1
+                    else:
+                        fresh.append(row)
+                if fresh:
+                    store.import_messages(session_id, fresh)
+                    counts["messages"] += len(fresh)
+            elif kind == "end":
+                ended = True
+            report(f.tell(), total, counts)
+    counts["complete"] = ended
+    report(total, total, counts, force=True)
+    return counts
+
+
+def print_progress(done, total, counts):
+    percent = done / total * 100 if total else 100
+    sys.stderr.write(f"\r{percent:5.1f}%  会话 {counts['sessions']}  消息 {counts['messages']}")
+    sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GrokChat会话档案导出/导入")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("db", help="会话数据库（sessions.db）")
+    parser.add_argument("path", help="档案文件：.jsonl为JSONL格式，其它扩展名为二进制格式")
+    parser.add_argument("--format", choices=["jsonl", "binary"], help="导出格式（默认按扩展名判断）")
+    args = parser.parse_args()
+    store = SessionStore(args.db)
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            counts = export_archive(store, args.path, args.format, print_progress)
+        else:
+            counts = import_archive(store, args.path, print_progress)
+    except (TransferError, OSError, sqlite3.Error) as e:
+        sys.stderr.write(f"\n{e}\n")
+        sys.exit(1)
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - started
+    sys.stderr.write("\n")
+    if args.command == "export":
+        print(f"已导出 {counts['sessions']}个会话，{counts['messages']}条消息到 {args.path}（{elapsed:.1f}秒）")
+    else:
+        print(f"已导入 {counts['sessions']}个新会话，合并 {counts['merged_sessions']}个已有会话；"
+              f"新增 {counts['messages']}条消息，跳过重复 {counts['duplicates']}条（{elapsed:.1f}秒）")
+        if not counts["complete"]:
+            print("警告：档案缺少结束记录，可能不完整")
+
+
+if __name__ == "__main__":
+    main()
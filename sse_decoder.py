@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式SSE解码（与界面、网络库无关，直接处理原始字节块）
+优化点：1. 事件可跨网络块、可多行data，支持event/id字段和注释行 2. 只在派发事件时拼接data，不逐行解码成str
+        （一块恰好是一个单行事件时走快速路径，不拆行）
+        3. JSON解码可替换，装了orjson时默认使用 4. 格式错误的事件计数并保留最后一条原因，不再静默丢弃
+        5. 只解析message事件，心跳等其它具名事件单独计数
+"""
+import json
+import re
+
+
+# 标准库json直接解析bytes要先探测编码，已知是UTF-8时先解码更快
+JSON_DECODER = json.JSONDecoder()
+SCAN_ONCE = JSON_DECODER.scan_once
+
+
+def json_loads(data):
+    text = data.decode("utf-8")
+    # 直接调用扫描器，省去decode前后两次空白匹配；前后有空白或多余内容时交给decode（报错信息也由它给出）
+    try:
+        value, end = SCAN_ONCE(text, 0)
+    except StopIteration:
+        return JSON_DECODER.decode(text)
+    if end != len(text):
+        return JSON_DECODER.decode(text)
+    return value
+
+
+try:
+    import orjson
+    default_loads = orjson.loads
+except ImportError:
+    orjson = None
+    default_loads = json_loads
+
+DONE = b"[DONE]"
+# 一块恰好是一个单行data事件（没有\r）
+SINGLE_EVENT = re.compile(rb"data: ([^\r\n]*)\n\n")
+
+
+# 协议层：字节块 -> 完整事件（按SSE规范，空行结束一个事件）
+# 事件为 (event, data, id) 元组：event未指定时为"message"，data为bytes，多行data以\n连接
+class SSEDecoder:
+    def __init__(self):
+        self.buffer = b""
+        self.data = []
+        self.event = None
+        self.last_id = None
+
+    def feed(self, chunk):
+        # 快速路径：缓冲区为空、本块恰好是一个单行data事件（实时流中iter_any多为如此），不拆行、不拼接
+        if not self.buffer and not self.data:
+            match = SINGLE_EVENT.fullmatch(chunk)
+            if match is not None:
+                event = self.event or "message"
+                self.event = None
+                return [(event, match.group(1), self.last_id)]
+        # 缓冲区中的\r已规范化（只可能剩下末尾被切开的一个\r），只需检查新块
+        has_cr = b"\r" in chunk or self.buffer.endswith(b"\r")
+        data = self.buffer + chunk if self.buffer else chunk
+        if has_cr:
+            # 以\r结尾时可能是被切开的\r\n，留到下一块再处理
+            tail = b"\r" if data.endswith(b"\r") else b""
+            if tail:
+                data = data[:-1]
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + tail
+        lines = data.split(b"\n")
+        # 最后一段是不完整的行，留在缓冲区
+        self.buffer = lines.pop()
+        events = []
+        data_lines = self.data
+        for line in lines:
+            # 绝大多数行是data，先走快速分支
+            if line.startswith(b"data: "):
+                data_lines.append(line[6:])
+            elif not line:
+                if data_lines:
+                    events.append((self.event or "message",
+                                   data_lines[0] if len(data_lines) == 1 else b"\n".join(data_lines), self.last_id))
+                    data_lines = self.data = []
+                self.event = None
+            else:
+                self.field(line)
+        return events
+
+    def field(self, line):
+        name, colon, value = line.partition(b":")
+        if not name:
+            return  # 注释行（心跳）
+        if colon and value.startswith(b" "):
+            value = value[1:]
+        if name == b"data":
+            self.data.append(value)
+        elif name == b"event":
+            self.event = value.decode("utf-8", "replace")
+        elif name == b"id":
+            self.last_id = value.decode("utf-8", "replace")
+
+    # 流结束：缓冲区末尾的\r不会再等到\n，按行结束处理，返回因此完成的事件
+    def close(self):
+        if self.buffer.endswith(b"\r"):
+            return self.feed(b"\n")
+        return []
+
+    def pending(self):
+        # 流结束时还有未派发的内容：最后一个事件不完整
+        return bool(self.data or self.buffer.strip())
+
+
+# 业务层：事件 -> 回复文本片段（OpenAI兼容的chat.completion.chunk格式）
+class ChatStreamParser:
+    def __init__(self, loads=None):
+        self.decoder = SSEDecoder()
+        self.loads = loads or default_loads
+        self.done = False
+        self.events = 0
+        self.errors = 0
+        self.last_error = None
+        self.ignored = 0  # 回复内容以外的具名事件（如心跳event: ping）
+
+    def error(self, reason):
+        self.errors += 1
+        self.last_error = reason
+
+    # 返回本块中解析出的文本片段列表；收到[DONE]后忽略后续数据
+    def feed(self, chunk):
+        if self.done:
+            return []
+        return self.handle(self.decoder.feed(chunk))
+
+    def handle(self, events):
+        contents = []
+        loads = self.loads
+        for event, data, _ in events:
+            self.events += 1
+            if data == DONE:
+                self.done = True
+                break
+            if event != "message":
+                if event == "error":
+                    self.error(f"服务端错误事件：{data[:200].decode('utf-8', 'replace')}")
+                else:
+                    # 只有message事件是回复片段，其它事件不解析，也不算格式错误
+                    self.ignored += 1
+                continue
+            try:
+                choices = loads(data)["choices"]
+                # choices为空的块（如末尾的用量统计）不是错误
+                content = choices[0]["delta"].get("content") if choices else None
+            except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+                self.error(f"{type(e).__name__}: {data[:200].decode('utf-8', 'replace')}")
+                continue
+            if content:
+                contents.append(content)
+        return contents
+
+    # 返回流末尾才完成的事件中的文本片段（如以单独\r换行的最后一个事件）
+    def close(self):
+        if self.done:
+            return []
+        contents = self.handle(self.decoder.close())
+        if not self.done and self.decoder.pending():
+            self.error("流在事件中途结束")
+        return contents